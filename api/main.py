@@ -1,61 +1,195 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Response
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Response, Query, Request
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 import os
 import torch
-from typing import Union, List
+from typing import Union, List, Optional, Literal
+import numpy as np
 from sqlalchemy.orm import Session
 import pandas as pd
 import io
+import csv
+import time
 
 # Import shared functions and model loader
-from api.models import load_model
-from api.utils.embedding import get_gin_embedding, calculate_query_distances
+from api.models import InferenceEngine
+from api.utils.embedding import get_gin_embedding, pairwise_distances
+from api.utils.pairwise import distance_matrix_stream
+from api.utils.batching import EmbeddingBatcher
+from api.utils.cache import EmbeddingCache, get_cached_gin_embedding
+from api.utils.search_index import EmbeddingIndex
+from api.utils.postprocess import format_embedding, stored_embedding
+from api.utils.streaming import UndecodableLine, read_upload_lines, format_tsv_rows, stream_tsv_chunks
+from api.utils.preprocess import GraphPipeline
+from api.utils.jobs import JobManager
+from api.utils.serialization import response_format, matrix_response
+from api.utils.metrics import stage, staged, begin_request, end_request, observe_request, server_timing
+from api.utils.shared_state import SharedStateStore
+from config.settings import MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH
+from config.settings import SEARCH_INDEX_MODE, SEARCH_IVF_NLIST, SEARCH_IVF_NPROBE, SEARCH_INDEX_REFRESH_SECONDS, SEARCH_LENGTH_BUCKET
+from config.settings import SEARCH_QUERY_BLOCK, SEARCH_TILE_SIZE
+from config.settings import GRAPH_WORKERS, GRAPH_PREFETCH_BATCHES, TORCH_NUM_THREADS, EMBED_MAX_BATCH_NODES
+from config.settings import JOB_WORKERS, JOB_CHUNK_SIZE, JOB_DATA_DIR, EMBEDDING_STORAGE_DTYPE
+from config.settings import MODEL_PATH, INFERENCE_BACKEND, INFERENCE_WARMUP_LENGTHS, INFERENCE_ACCURACY_TOLERANCE
+from config.settings import SHARED_STATE_DIR, SHARED_STATE_POLL_SECONDS, DATABASE_STREAM_CHUNK_SIZE
 from external.GINFINITY.src.utils import is_valid_dot_bracket as validate_structure
-from external.GINFINITY.src.utils import calculate_distances
 
-# Add database dependency and model import:
-from db.connection import get_db
-from db.models import Embedding
+# Add database dependency and data access helpers:
+from db.connection import get_db, SessionLocal, AsyncSessionLocal, async_engine
+from db.repository import fetch_records, fetch_records_async
 
-# Import health router
-from api.routes import health
+# Import health and job routers
+from api.routes import health, jobs, metrics
 
 # Imports the StaticFiles class to serve static files
 from fastapi.staticfiles import StaticFiles 
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+
+# Under `python -m api.server --workers N` the parent shares the model weights and
+# search index snapshots with every worker through this store
+shared_store = SharedStateStore(SHARED_STATE_DIR, poll_seconds=SHARED_STATE_POLL_SECONDS) if SHARED_STATE_DIR else None
+
+# Set device; the model is loaded in the lifespan hook so importing the app stays cheap
+device = "cuda" if torch.cuda.is_available() else "cpu"
+engine = InferenceEngine(MODEL_PATH, device, backend=INFERENCE_BACKEND, warmup_lengths=INFERENCE_WARMUP_LENGTHS,
+                         accuracy_tolerance=INFERENCE_ACCURACY_TOLERANCE, shared_store=shared_store)
+
+# Created at startup, once the model metadata and checkpoint hash are known
+graph_pipeline = None
+embedding_cache = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global graph_pipeline, embedding_cache
+    # Torch's thread count is process-wide, so it is set here once rather than per request
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    await run_in_threadpool(engine.load)
+    # Process pool that builds graph tensors ahead of inference
+    if GRAPH_WORKERS > 0:
+        graph_pipeline = GraphPipeline(engine.graph_encoding, workers=GRAPH_WORKERS, prefetch=GRAPH_PREFETCH_BATCHES)
+    # Cache embeddings by content; the namespace ties entries to the loaded weights and backend
+    embedding_cache = EmbeddingCache(engine.cache_namespace, max_items=EMBEDDING_CACHE_SIZE, disk_path=EMBEDDING_CACHE_PATH or None)
+    app.state.embedding_cache = embedding_cache
+    await batcher.start()
+    job_manager.start()
+    yield
+    await batcher.stop()
+    job_manager.shutdown()
+    if graph_pipeline is not None:
+        graph_pipeline.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Initialize FastAPI app and include API routes first
-app = FastAPI(title="RNA Similarity API")
+app = FastAPI(title="RNA Similarity API", lifespan=lifespan)
 app.include_router(health.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
+app.state.inference_engine = engine
 
-# Mount static files on a dedicated subpath
-app.mount("/frontend", StaticFiles(directory="ginfinity-frontend/dist", html=True), name="frontend")
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Collect per-stage timings for every request into the /metrics histograms.
+    They are observed once the response body has been sent, so the stages of
+    streamed bodies are included. Requests sent with `X-Profile: 1` get the
+    breakdown of the stages done before the headers in a Server-Timing header.
+    """
+    token, timings = begin_request()
+    start = time.perf_counter()
+    
+    def observe(status):
+        endpoint = getattr(request.scope.get("route"), "path", "unmatched")
+        observe_request(timings, endpoint, request.method, status, time.perf_counter() - start)
+    
+    try:
+        response = await call_next(request)
+    except Exception:
+        observe(500)
+        raise
+    finally:
+        end_request(token)
+    if request.headers.get("x-profile", "").lower() in ("1", "true", "yes"):
+        response.headers["Server-Timing"] = server_timing(timings, time.perf_counter() - start)
+    body = response.body_iterator
+    
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            observe(response.status_code)
+    
+    response.body_iterator = observed_body()
+    return response
+
+# Mount static files on a dedicated subpath (once the frontend has been built)
+FRONTEND_DIR = "ginfinity-frontend/dist"
+if os.path.isdir(FRONTEND_DIR):
+    app.mount("/frontend", StaticFiles(directory=FRONTEND_DIR, html=True), name="frontend")
 
 @app.get("/{path_name}")
 async def catch_all(path_name: str):
-    return FileResponse("ginfinity-frontend/dist/index.html")
+    return FileResponse(os.path.join(FRONTEND_DIR, "index.html"))
 
+def _embed(structures, batch_size=128, **kwargs):
+    """
+    Embed structures with the loaded engine, through the cache and graph pipeline.
+    Unless EMBED_MAX_BATCH_NODES is 0, batches are planned by node count and
+    batch_size is ignored (see BatchPlan).
+    """
+    return get_cached_gin_embedding(embedding_cache, engine.model, engine.graph_encoding, structures, engine.device,
+                                    batch_size=batch_size, pipeline=graph_pipeline,
+                                    max_batch_nodes=EMBED_MAX_BATCH_NODES or None, **kwargs)
 
-# Mount static files on a dedicated subpath
-app.mount("/frontend", StaticFiles(directory="ginfinity-frontend/dist", html=True), name="frontend")
+# Vector index for /search, loaded lazily on the first query and refreshed incrementally
+# (in multi-worker mode it follows the snapshots published by the parent instead)
+search_index = EmbeddingIndex(mode=SEARCH_INDEX_MODE, nlist=SEARCH_IVF_NLIST, nprobe=SEARCH_IVF_NPROBE,
+                              refresh_seconds=SEARCH_INDEX_REFRESH_SECONDS, length_bucket=SEARCH_LENGTH_BUCKET,
+                              load_chunk_size=DATABASE_STREAM_CHUNK_SIZE, shared_store=shared_store)
+app.state.search_index = search_index
 
-# Set device and load the model once at startup
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model_checkpoint = os.getenv("MODEL_PATH", "models/model_weights.pth")
-model = load_model(model_checkpoint, device)
-graph_encoding = model.metadata.get("graph_encoding", "standard")
+# Coalesce concurrent single-structure requests into batched inference calls
+def _embed_structures(structures):
+    return _embed(structures, batch_size=len(structures))
+
+batcher = EmbeddingBatcher(_embed_structures, max_batch_size=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS)
+app.state.embedding_batcher = batcher
+
+# Background bulk embedding jobs, checkpointed in the embedding_jobs table. They skip
+# the embedding cache: a bulk run would evict every hot entry and copy the table into it
+def _embed_job_structures(structures):
+    emb_results = get_gin_embedding(engine.model, engine.graph_encoding, structures, engine.device, batch_size=128,
+                                    pipeline=graph_pipeline, max_batch_nodes=EMBED_MAX_BATCH_NODES or None)
+    return [emb_list[0][1] for emb_list in emb_results]
+
+job_manager = JobManager(SessionLocal, _embed_job_structures, validate_structure, data_dir=JOB_DATA_DIR,
+                         workers=JOB_WORKERS, chunk_size=JOB_CHUNK_SIZE, storage_dtype=EMBEDDING_STORAGE_DTYPE)
+app.state.job_manager = job_manager
 
 # Define Pydantic models for input and output
 class EmbedRequest(BaseModel):
     structure: str = Field(..., description="RNA secondary structure in dot-bracket notation")
+    L: Optional[int] = Field(None, ge=1, description="Window length; if set, one embedding is returned per sliding window")
+    keep_paired_neighbors: bool = Field(False, description="Keep the paired partners of window nodes in each window")
 
 class EmbedResponse(BaseModel):
     embeddings: list[str] = Field(..., description="List of embedding vectors (as comma-separated floats)")
+    window_starts: Optional[List[int]] = Field(None, description="Start index of each window when L is set")
 
 class CompareRequest(BaseModel):
     structure1: str = Field(..., description="First RNA secondary structure in dot-bracket notation")
     structure2: Union[str, List[str]] = Field(..., description="Second RNA structure(s) in dot-bracket notation")
-    metric: str = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+    metric: Literal["squared", "cosine"] = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+
+class PairwiseRequest(BaseModel):
+    structures: List[str] = Field(..., min_length=1, description="RNA structures in dot-bracket notation; rows/columns follow this order")
+    metric: Literal["squared", "cosine"] = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+    mode: Literal["full", "upper", "topk"] = Field("full", description="Full N x N matrix, condensed upper triangle, or k nearest neighbours per row")
+    k: int = Field(10, ge=1, description="Neighbours per structure in 'topk' mode")
+    block_size: int = Field(1024, ge=1, le=16384, description="Rows computed per block")
 
 class CompareResponse(BaseModel):
     similarity_score: Union[float, List[float]] = Field(..., description="Similarity score(s) between embeddings")
@@ -77,7 +211,7 @@ class EmbeddingOut(BaseModel):
     seq_len: Union[int, None] = None
     paired_ratio: Union[float, None] = None
     window_start: Union[str, None] = None
-    embedding_vector: str
+    embedding_vector: Union[str, None] = None
 
     class Config:
         from_attributes = True
@@ -89,12 +223,27 @@ class SearchResult(BaseModel):
     class Config:
         from_attributes = True
 
-class SearchRequest(BaseModel):
+# Metadata filters shared by /search and /batch_search, pushed down to the search index
+SEARCH_FILTERS = ("chr", "strand", "min_seq_len", "max_seq_len", "min_paired_ratio", "max_paired_ratio")
+
+class SearchFilters(BaseModel):
+    chr: Optional[str] = Field(None, description="Only search this chromosome")
+    strand: Optional[str] = Field(None, description="Only search this strand")
+    min_seq_len: Optional[int] = Field(None, ge=0, description="Minimum sequence length")
+    max_seq_len: Optional[int] = Field(None, ge=0, description="Maximum sequence length")
+    min_paired_ratio: Optional[float] = Field(None, ge=0, le=1, description="Minimum paired ratio")
+    max_paired_ratio: Optional[float] = Field(None, ge=0, le=1, description="Maximum paired ratio")
+
+    def filters(self):
+        return {name: getattr(self, name) for name in SEARCH_FILTERS}
+
+class SearchRequest(SearchFilters):
     structure: str = Field(..., description="RNA secondary structure in dot-bracket notation")
-    metric: str = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+    metric: Literal["squared", "cosine"] = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+    k: int = Field(30, ge=1, le=1000, description="Number of results to return")
 
 class SearchResponse(BaseModel):
-    results: list[SearchResult] = Field(..., description="Top 30 similar RNA embeddings and their distance metrics")
+    results: list[SearchResult] = Field(..., description="Top k similar RNA embeddings and their distance metrics")
 
 # Add new Pydantic models for batch embedding endpoint
 class BatchStructureItem(BaseModel):
@@ -103,132 +252,274 @@ class BatchStructureItem(BaseModel):
 
 class BatchEmbedRequest(BaseModel):
     items: List[BatchStructureItem] = Field(..., description="List of structures with unique ids")
+    L: Optional[int] = Field(None, ge=1, description="Window length; if set, each item gets one embedding per sliding window")
+    keep_paired_neighbors: bool = Field(False, description="Keep the paired partners of window nodes in each window")
 
 class BatchEmbedResponse(BaseModel):
     embeddings: List[dict] = Field(
-        ..., description="List of {id: string, embedding: string} pairs"
+        ..., description="List of {id: string, embedding: string} pairs, or {id, windows: [{start, embedding}]} when L is set"
     )
 
+class BatchSearchRequest(SearchFilters):
+    items: List[BatchStructureItem] = Field(..., min_length=1, description="Query structures with unique ids")
+    metric: Literal["squared", "cosine"] = Field("squared", description="Distance metric: 'squared' or 'cosine'")
+    k: int = Field(30, ge=1, le=1000, description="Number of results per query")
+    include_records: bool = Field(True, description="Include the full database record of every hit")
+
+class BatchSearchHit(BaseModel):
+    id: int
+    metric: float
+    embedding: Optional[EmbeddingOut] = None
+
+class BatchSearchResult(BaseModel):
+    id: str
+    hits: List[BatchSearchHit]
+
+class BatchSearchResponse(BaseModel):
+    results: List[BatchSearchResult] = Field(..., description="Ranked hits of every query, in request order")
+
 # Endpoint to generate embedding(s) for a given RNA structure
 @app.post("/embed", response_model=EmbedResponse)
-def embed_endpoint(request: EmbedRequest):
+async def embed_endpoint(request: EmbedRequest, fmt: str = Depends(response_format)):
     try:
-        validate_structure(request.structure)
+        with stage("validate"):
+            validate_structure(request.structure)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     try:
-        # Pass a list even for a single structure
-        emb_lists = get_gin_embedding(model, graph_encoding, [request.structure], device, batch_size=1, cpus=1)
-        embeddings = [emb for _, emb in emb_lists[0]]
-        return EmbedResponse(embeddings=embeddings)
+        if request.L is None:
+            with stage("embed"):
+                emb_list = await batcher.submit(request.structure)
+            if fmt != "json":
+                return matrix_response(fmt, [0], [emb_list[0][1]])
+            with stage("format"):
+                embeddings = [format_embedding(emb) for _, emb in emb_list]
+            return EmbedResponse(embeddings=embeddings)
+        # Windowed embeddings skip the micro-batcher, which only handles whole structures
+        with stage("embed"):
+            emb_list = (await run_in_threadpool(
+                _embed, [request.structure], L=request.L, keep_paired_neighbors=request.keep_paired_neighbors))[0]
+        if fmt != "json":
+            # Structures shorter than L have no windows
+            windows = [(start, emb) for start, emb in emb_list if len(emb)]
+            return matrix_response(fmt, [start for start, _ in windows], [emb for _, emb in windows])
+        with stage("format"):
+            embeddings = [format_embedding(emb) for _, emb in emb_list]
+        return EmbedResponse(embeddings=embeddings, window_starts=[start for start, _ in emb_list])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing embedding: {str(e)}")
 
 # Endpoint to compare two RNA structures
 @app.post("/compare", response_model=CompareResponse)
-def compare_endpoint(request: CompareRequest):
+async def compare_endpoint(request: CompareRequest):
     try:
-        validate_structure(request.structure1)
-        if isinstance(request.structure2, list):
-            for s in request.structure2:
-                validate_structure(s)
-        else:
-            validate_structure(request.structure2)
+        with stage("validate"):
+            validate_structure(request.structure1)
+            if isinstance(request.structure2, list):
+                for s in request.structure2:
+                    validate_structure(s)
+            else:
+                validate_structure(request.structure2)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        emb_list1 = get_gin_embedding(model, graph_encoding, [request.structure1], device, batch_size=1, cpus=1)[0]
-        vec1 = [float(x) for x in emb_list1[0][1].split(',')]
-        
-        def compute_similarity(vec_a, vec_b, metric):
-            embeddings = [vec_a, vec_b]
-            distances = calculate_distances(embeddings, metric=metric, num_workers=1, batch_size=1)
-            return distances[0][2]
-        
+        structures2 = request.structure2 if isinstance(request.structure2, list) else [request.structure2]
+        structures = [request.structure1] + structures2
+        with stage("embed"):
+            if isinstance(request.structure2, list):
+                # One-vs-many is already a batch; the micro-batcher is for coalescing single structures
+                emb_lists = await run_in_threadpool(_embed, structures)
+            else:
+                emb_lists = await batcher.submit_many(structures)
+        vectors = [emb_list[0][1] for emb_list in emb_lists]
+        if any(len(vec) != len(vectors[0]) for vec in vectors[1:]):
+            raise HTTPException(status_code=400, detail="Embedding dimensions do not match.")
+        # One-vs-many in a single call to the shared distance kernel
+        with stage("distance"):
+            matrix = torch.from_numpy(np.stack(vectors))
+            scores = pairwise_distances(matrix[:1], matrix[1:], request.metric)[0].tolist()
         if isinstance(request.structure2, list):
-            scores = []
-            emb_lists2 = get_gin_embedding(model, graph_encoding, request.structure2, device, batch_size=1, cpus=1)
-            for emb_list2 in emb_lists2:
-                vec2 = [float(x) for x in emb_list2[0][1].split(',')]
-                if len(vec1) != len(vec2):
-                    raise HTTPException(status_code=400, detail="Embedding dimensions do not match.")
-                scores.append(compute_similarity(vec1, vec2, request.metric))
             return CompareResponse(similarity_score=scores)
-        else:
-            emb_list2 = get_gin_embedding(model, graph_encoding, [request.structure2], device, batch_size=1, cpus=1)[0]
-            vec2 = [float(x) for x in emb_list2[0][1].split(',')]
-            if len(vec1) != len(vec2):
-                raise HTTPException(status_code=400, detail="Embedding dimensions do not match.")
-            score = compute_similarity(vec1, vec2, request.metric)
-            return CompareResponse(similarity_score=score)
+        return CompareResponse(similarity_score=scores[0])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing similarity: {str(e)}")
 
+# All-vs-all distance matrix, streamed as a .npy body
+@app.post("/pairwise")
+async def pairwise_endpoint(request: PairwiseRequest):
+    with stage("validate"):
+        for idx, structure in enumerate(request.structures):
+            try:
+                validate_structure(structure)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid structure at index {idx}: {str(e)}")
+    
+    try:
+        with stage("embed"):
+            emb_results = await run_in_threadpool(_embed, request.structures)
+        vectors = [emb_list[0][1] for emb_list in emb_results]
+        if any(len(vec) != len(vectors[0]) for vec in vectors[1:]):
+            raise ValueError("Embedding dimensions do not match.")
+        matrix = np.stack(vectors)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing embeddings: {str(e)}")
+    
+    n = len(request.structures)
+    shape = {"full": f"{n},{n}", "upper": f"{n * (n - 1) // 2}", "topk": f"{n},{max(0, min(request.k, n - 1))}"}[request.mode]
+    # The blocks are computed lazily as the client reads the body
+    body = staged(distance_matrix_stream(matrix, metric=request.metric, mode=request.mode, k=request.k, block_size=request.block_size),
+                  "distance")
+    return StreamingResponse(body, media_type="application/octet-stream",
+                             headers={"X-Matrix-Mode": request.mode, "X-Matrix-Shape": shape,
+                                      "Content-Disposition": f"attachment; filename=pairwise_{request.mode}.npy"})
+
 # Endpoint to search for similar RNA embeddings in the database
 @app.post("/search", response_model=SearchResponse)
-def search_endpoint(request: SearchRequest, db: Session = Depends(get_db)):
+async def search_endpoint(request: SearchRequest, db: Session = Depends(get_db), fmt: str = Depends(response_format)):
     try:
-        validate_structure(request.structure)
+        with stage("validate"):
+            validate_structure(request.structure)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        # Pass list for consistency
-        query_emb_list = get_gin_embedding(model, graph_encoding, [request.structure], device, batch_size=1, cpus=1)[0]
-        query_vector = [float(x) for x in query_emb_list[0][1].split(',')]
+        with stage("embed"):
+            query_emb_list = await batcher.submit(request.structure)
+        query_vector = query_emb_list[0][1]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing query embedding: {str(e)}")
     
     try:
-        embeddings = db.query(Embedding).all()
-        candidate_vectors = []
-        valid_records = []
-        for rec in embeddings:
-            candidate_vec = [float(x) for x in rec.embedding_vector.split(',')]
-            if len(query_vector) != len(candidate_vec):
-                continue
-            candidate_vectors.append(candidate_vec)
-            valid_records.append(rec)
-        
-        batch_size = int(os.getenv("BATCH_SIZE", 512))
-        distances = calculate_query_distances(query_vector, candidate_vectors, request.metric, batch_size=batch_size)
-        scored = list(zip(distances, valid_records))
-        scored.sort(key=lambda x: x[0])
-        top30 = scored[:30]
-        top30_out = [SearchResult(embedding=EmbeddingOut.from_orm(rec), metric=dist) for dist, rec in top30]
-        return SearchResponse(results=top30_out)
+        if fmt != "json":
+            # Binary results carry ids, distances and the hit embeddings straight from the index
+            ids, distances, vectors = await run_in_threadpool(_search_index, db, query_vector, request.metric, request.k,
+                                                              request.filters(), True)
+            return matrix_response(fmt, ids, vectors, dim=len(query_vector), distance=distances)
+        ids, distances = await run_in_threadpool(_search_index, db, query_vector, request.metric, request.k, request.filters())
+        # Only the top-k rows are hydrated with their full metadata
+        records = await _fetch_records(db, ids.tolist())
+        with stage("format"):
+            results = [SearchResult(embedding=_embedding_out(records[i]), metric=float(dist))
+                       for i, dist in zip(ids.tolist(), distances.tolist()) if i in records]
+        return SearchResponse(results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching database: {str(e)}")
+
+def _search_index(db, query_vector, metric, k=30, filters=None, with_vectors=False):
+    with stage("index_refresh"):
+        search_index.ensure_fresh(db)
+    with stage("score"):
+        return search_index.search(query_vector, k=k, metric=metric, filters=filters, with_vectors=with_vectors)
+
+async def _fetch_records(db, ids):
+    """
+    Full records of the given ids, awaited on the async engine when DATABASE_ASYNC
+    is enabled, otherwise fetched with the sync session in the threadpool.
+    """
+    if not ids:
+        return {}
+    with stage("db_fetch"):
+        if AsyncSessionLocal is not None:
+            async with AsyncSessionLocal() as adb:
+                return await fetch_records_async(adb, ids)
+        return await run_in_threadpool(fetch_records, db, ids)
+
+def _embedding_out(rec):
+    out = EmbeddingOut.from_orm(rec)
+    if out.embedding_vector is None:
+        # Packed-only rows are turned into text here, at the API boundary
+        out.embedding_vector = format_embedding(stored_embedding(rec))
+    return out
+
+# Search the database for many structures at once
+@app.post("/batch_search", response_model=BatchSearchResponse)
+async def batch_search_endpoint(request: BatchSearchRequest, db: Session = Depends(get_db)):
+    with stage("validate"):
+        for item in request.items:
+            try:
+                validate_structure(item.structure)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid structure for id {item.id}: {str(e)}")
+    
+    try:
+        with stage("embed"):
+            emb_results = await run_in_threadpool(_embed, [item.structure for item in request.items])
+        queries = np.stack([emb_list[0][1] for emb_list in emb_results])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing query embeddings: {str(e)}")
+    
+    try:
+        ids, distances = await run_in_threadpool(_batch_search_index, db, request, queries)
+        records = {}
+        if request.include_records:
+            # Every distinct hit is loaded once, however many queries share it
+            records = await _fetch_records(db, np.unique(ids).tolist())
+        with stage("format"):
+            records = {i: _embedding_out(rec) for i, rec in records.items()}
+            results = [BatchSearchResult(id=item.id, hits=[BatchSearchHit(id=i, metric=dist, embedding=records.get(i))
+                                                           for i, dist in zip(row_ids, row_dist)])
+                       for item, row_ids, row_dist in zip(request.items, ids.tolist(), distances.tolist())]
+        return BatchSearchResponse(results=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching database: {str(e)}")
 
+def _batch_search_index(db, request, queries):
+    with stage("index_refresh"):
+        search_index.ensure_fresh(db)
+    with stage("score"):
+        return search_index.search_many(queries, k=request.k, metric=request.metric, filters=request.filters(),
+                                        query_block=SEARCH_QUERY_BLOCK, tile_size=SEARCH_TILE_SIZE)
+
 # New endpoint to compute embeddings from a batch of structures
 @app.post("/batch_embed", response_model=BatchEmbedResponse)
-def batch_embed_endpoint(request: BatchEmbedRequest):
+def batch_embed_endpoint(request: BatchEmbedRequest, fmt: str = Depends(response_format)):
     # Validate all structures
-    for item in request.items:
-        try:
-            validate_structure(item.structure)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid structure for id {item.id}: {str(e)}")
+    with stage("validate"):
+        for item in request.items:
+            try:
+                validate_structure(item.structure)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid structure for id {item.id}: {str(e)}")
     
     try:
         # Extract structures from the request
         structures = [item.structure for item in request.items]
-        # Compute embeddings (using L=None for a single embedding per structure)
-        emb_results = get_gin_embedding(model, graph_encoding, structures, device, L=None, batch_size=128, cpus=2)
-        # Prepare output: each emb_results element is a list with one tuple (None, embedding_string)
+        # Compute embeddings (L=None gives a single embedding per structure)
+        with stage("embed"):
+            emb_results = _embed(structures, L=request.L, keep_paired_neighbors=request.keep_paired_neighbors)
+        if fmt != "json":
+            # One row per embedding; windowed requests add the window start of each row
+            rows = [(item.id, start, emb) for item, emb_list in zip(request.items, emb_results)
+                    for start, emb in emb_list if len(emb)]
+            columns = {"window_start": [start for _, start, _ in rows]} if request.L is not None else {}
+            return matrix_response(fmt, [i for i, _, _ in rows], [emb for _, _, emb in rows], **columns)
+        if request.L is not None:
+            output = [{"id": item.id, "windows": [{"start": start, "embedding": format_embedding(emb)} for start, emb in emb_list]}
+                      for item, emb_list in zip(request.items, emb_results)]
+            return BatchEmbedResponse(embeddings=output)
+        # Prepare output: each emb_results element is a list with one tuple (None, embedding)
         output = []
-        for idx, emb_list in enumerate(emb_results):
-            # Pick the first embedding from each result
-            embedding_str = emb_list[0][1]
-            output.append({"id": request.items[idx].id, "embedding": embedding_str})
+        with stage("format"):
+            for idx, emb_list in enumerate(emb_results):
+                # Pick the first embedding from each result
+                embedding_str = format_embedding(emb_list[0][1])
+                output.append({"id": request.items[idx].id, "embedding": embedding_str})
         return BatchEmbedResponse(embeddings=output)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing batch embeddings: {str(e)}")
 
 # New endpoint to process TSV file and add an embedding_vector column.
 @app.post("/tsv_embed")
-async def tsv_embed_endpoint(file: UploadFile = File(...)):
+async def tsv_embed_endpoint(
+    file: UploadFile = File(...),
+    stream: bool = Query(False, description="Stream rows back as they are embedded, with constant memory"),
+    rows_per_chunk: int = Query(1024, ge=1, le=65536, description="Rows embedded per chunk in streaming mode"),
+    fmt: str = Depends(response_format),
+):
+    if stream:
+        # Streaming output is always TSV
+        return await _stream_tsv_embed(file, rows_per_chunk)
     try:
         content = await file.read()
         df = pd.read_csv(io.StringIO(content.decode("utf-8")), sep="\t")
@@ -240,10 +531,73 @@ async def tsv_embed_endpoint(file: UploadFile = File(...)):
     
     # Compute embeddings for each structure (using L=None for a single embedding)
     structures = df["secondary_structure"].tolist()
-    emb_results = get_gin_embedding(model, graph_encoding, structures, device, L=None, batch_size=128, cpus=2)
-    embeddings = [emb_list[0][1] for emb_list in emb_results]  # pick the first embedding from each result
-    
-    df["embedding_vector"] = embeddings
-    output = io.StringIO()
-    df.to_csv(output, sep="\t", index=False)
+    with stage("embed"):
+        emb_results = await run_in_threadpool(_embed, structures)
+    if fmt != "json":
+        return matrix_response(fmt, df["id"].astype(str).tolist(), [emb_list[0][1] for emb_list in emb_results])
+    with stage("format"):
+        embeddings = [format_embedding(emb_list[0][1]) for emb_list in emb_results]  # pick the first embedding from each result
+        df["embedding_vector"] = embeddings
+        output = io.StringIO()
+        df.to_csv(output, sep="\t", index=False)
     return Response(content=output.getvalue(), media_type="text/tab-separated-values")
+
+async def _stream_tsv_embed(file, rows_per_chunk):
+    """
+    Streaming variant of /tsv_embed: the upload is read and embedded chunk by chunk
+    and rows are sent as soon as their chunk is done. Rows that cannot be embedded
+    get an empty embedding_vector and a message in embedding_error instead of
+    failing the whole file.
+    """
+    lines = read_upload_lines(file)
+    try:
+        header_line = await lines.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Invalid TSV file.")
+    if isinstance(header_line, UndecodableLine):
+        raise HTTPException(status_code=400, detail="Invalid TSV file.")
+    header = next(csv.reader([header_line], delimiter="\t"))
+    if not {"id", "secondary_structure"}.issubset(header):
+        raise HTTPException(status_code=400, detail="TSV must contain 'id' and 'secondary_structure' columns.")
+    structure_col = header.index("secondary_structure")
+    
+    def process_rows(rows, decode_errors):
+        errors = list(decode_errors)
+        valid = []
+        for idx, row in enumerate(rows):
+            if errors[idx]:
+                continue
+            if len(row) != len(header):
+                errors[idx] = f"Expected {len(header)} fields, found {len(row)}"
+                continue
+            try:
+                validate_structure(row[structure_col])
+                valid.append(idx)
+            except Exception as e:
+                errors[idx] = f"Invalid structure: {str(e)}"
+        embeddings = [""] * len(rows)
+        if valid:
+            structures = [rows[idx][structure_col] for idx in valid]
+            try:
+                emb_results = _embed(structures)
+            except Exception:
+                # Embed the rows one by one so a single failing structure only
+                # marks its own row, as the micro-batcher does
+                emb_results = []
+                for idx, structure in zip(valid, structures):
+                    try:
+                        emb_results.append(_embed([structure])[0])
+                    except Exception as e:
+                        emb_results.append(None)
+                        errors[idx] = f"Error computing embedding: {str(e)}"
+            for idx, emb_list in zip(valid, emb_results):
+                if emb_list is not None:
+                    embeddings[idx] = format_embedding(emb_list[0][1])
+        return format_tsv_rows([row + [emb, err] for row, emb, err in zip(rows, embeddings, errors)])
+    
+    async def body():
+        yield format_tsv_rows([header + ["embedding_vector", "embedding_error"]])
+        async for chunk in stream_tsv_chunks(lines, process_rows, rows_per_chunk=rows_per_chunk):
+            yield chunk
+    
+    return StreamingResponse(body(), media_type="text/tab-separated-values")
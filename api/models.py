@@ -1,7 +1,18 @@
-import os
+import copy
+import logging
+import time
+
+import numpy as np
 import torch
 from external.GINFINITY.src.model.gin_model import GINModel
 
+from api.utils.cache import checkpoint_hash
+from api.utils.embedding import get_gin_embedding
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKENDS = ("eager", "compile", "quantized")
+
 def load_model(model_path, device="cpu"):
     """
     Load a trained GIN model from checkpoint.
@@ -9,4 +20,139 @@ def load_model(model_path, device="cpu"):
     model = GINModel.load_from_checkpoint(model_path, device)
     model.to(device)
     model.eval()
-    return model
\ No newline at end of file
+    return model
+
+def warmup_structure(length, stem=4, loop=4):
+    """
+    Synthetic dot-bracket structure of the given length made of repeated hairpins,
+    used to warm up and check a model on representative graph sizes.
+    """
+    unit = "(" * stem + "." * loop + ")" * stem + ".."
+    return (unit * (length // len(unit))).ljust(length, ".")
+
+def _compile_model(model):
+    # Shallow copy: parameters are shared, but the compiled forward_once only lives on the copy
+    compiled = copy.copy(model)
+    compiled.forward_once = torch.compile(model.forward_once, dynamic=True)
+    return compiled
+
+def _quantize_model(model, device):
+    if device != "cpu":
+        raise ValueError("Dynamic int8 quantization is only supported on CPU.")
+    # Returns a quantized copy; the eager model is left untouched for the accuracy check
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class InferenceEngine:
+    """
+    Loads the GIN checkpoint and prepares it for serving with one of the
+    INFERENCE_BACKENDS:
+
+    - "eager": the plain PyTorch model.
+    - "compile": forward_once wrapped with torch.compile.
+    - "quantized": Linear layers converted to dynamic int8 (CPU only).
+
+    `load` is meant to run once at startup (from the app's lifespan hook). It
+    warms the model up on synthetic structures of `warmup_lengths` nodes and,
+    for non-eager backends, compares their embeddings with the eager model.
+    If preparing the backend fails or the relative error exceeds
+    `accuracy_tolerance`, the engine falls back to eager. All inference runs
+    under torch.inference_mode (see get_gin_embedding).
+
+    With a `shared_store` the eager weights are mapped from the model exported
+    by the parent of a multi-worker server instead of read from model_path.
+    """
+
+    def __init__(self, model_path, device="cpu", backend="eager", warmup_lengths=(64, 256, 1024), warmup_batch_size=8, accuracy_tolerance=0.05,
+                 shared_store=None):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.model_path = model_path
+        self.device = device
+        self.requested_backend = backend
+        self.backend = None
+        self.warmup_lengths = tuple(warmup_lengths)
+        self.warmup_batch_size = warmup_batch_size
+        self.accuracy_tolerance = accuracy_tolerance
+        self.shared_store = shared_store
+        self.model = None
+        self.graph_encoding = None
+        self.checkpoint_hash = None
+        self.report = {}
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    @property
+    def cache_namespace(self):
+        """
+        Identifies the weights and backend producing the embeddings, for cache keys.
+        """
+        return f"{self.checkpoint_hash}:{self.backend}"
+
+    def load(self):
+        start = time.perf_counter()
+        if self.shared_store is not None:
+            eager, self.checkpoint_hash = self.shared_store.load_model(self.device)
+        else:
+            eager = load_model(self.model_path, self.device)
+            self.checkpoint_hash = checkpoint_hash(self.model_path)
+        self.graph_encoding = eager.metadata.get("graph_encoding", "standard")
+        self.report = {"requested_backend": self.requested_backend, "device": self.device,
+                       "shared_weights": self.shared_store is not None,
+                       "load_seconds": time.perf_counter() - start}
+
+        model, backend = eager, "eager"
+        if self.requested_backend != "eager":
+            try:
+                model = _compile_model(eager) if self.requested_backend == "compile" else _quantize_model(eager, self.device)
+                backend = self.requested_backend
+                self._warmup(model)
+                accuracy = self.check_accuracy(model, eager)
+                self.report["accuracy"] = accuracy
+                if not accuracy["passed"]:
+                    logger.warning("Backend %s exceeds accuracy tolerance (%s), falling back to eager", backend, accuracy)
+                    model, backend = eager, "eager"
+            except Exception as e:
+                logger.warning("Could not prepare backend %s, falling back to eager: %s", self.requested_backend, e)
+                self.report["error"] = str(e)
+                model, backend = eager, "eager"
+        if backend == "eager":
+            self._warmup(eager)
+
+        self.model, self.backend = model, backend
+        self.report["backend"] = backend
+        self.report["ready_seconds"] = time.perf_counter() - start
+        logger.info("Model ready: %s", self.report)
+        return self
+
+    def _warmup_structures(self):
+        return [warmup_structure(length) for length in self.warmup_lengths]
+
+    def _warmup(self, model):
+        """
+        Run single and batched passes over every warmup size so lazy
+        initialisation and compilation happen before the first request.
+        """
+        start = time.perf_counter()
+        for structure in self._warmup_structures():
+            get_gin_embedding(model, self.graph_encoding, [structure], self.device, batch_size=1)
+            get_gin_embedding(model, self.graph_encoding, [structure] * self.warmup_batch_size, self.device,
+                              batch_size=self.warmup_batch_size)
+        self.report["warmup_seconds"] = time.perf_counter() - start
+
+    def check_accuracy(self, model, reference):
+        """
+        Compare the embeddings of `model` with those of the eager `reference`
+        on the warmup structures, as relative L2 error per structure.
+        """
+        structures = self._warmup_structures()
+        expected = np.stack([r[0][1] for r in get_gin_embedding(reference, self.graph_encoding, structures, self.device, batch_size=len(structures))])
+        actual = np.stack([r[0][1] for r in get_gin_embedding(model, self.graph_encoding, structures, self.device, batch_size=len(structures))])
+        errors = np.linalg.norm(actual - expected, axis=1) / (np.linalg.norm(expected, axis=1) + 1e-8)
+        return {
+            "max_relative_error": float(errors.max()),
+            "mean_relative_error": float(errors.mean()),
+            "tolerance": self.accuracy_tolerance,
+            "passed": bool(errors.max() <= self.accuracy_tolerance),
+        }
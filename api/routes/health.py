@@ -1,7 +1,37 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 router = APIRouter()
 
 @router.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@router.get("/health/batcher")
+def batcher_stats(request: Request):
+    """
+    Queue depth and batch-size histogram of the embedding micro-batcher.
+    """
+    batcher = getattr(request.app.state, "embedding_batcher", None)
+    if batcher is None:
+        return {"status": "disabled"}
+    return batcher.stats()
+
+@router.get("/health/cache")
+def cache_stats(request: Request):
+    """
+    Hit, miss and eviction counters of the embedding cache.
+    """
+    cache = getattr(request.app.state, "embedding_cache", None)
+    if cache is None:
+        return {"status": "disabled"}
+    return cache.stats()
+
+@router.get("/health/model")
+def model_info(request: Request):
+    """
+    Backend, load/warmup timings and accuracy check of the inference engine.
+    """
+    engine = getattr(request.app.state, "inference_engine", None)
+    if engine is None or not engine.loaded:
+        return {"status": "loading"}
+    return engine.report
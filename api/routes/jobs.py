@@ -0,0 +1,71 @@
+import os
+import shutil
+from typing import Optional
+
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+router = APIRouter(prefix="/jobs")
+
+class DBJobRequest(BaseModel):
+    chr: Optional[str] = Field(None, description="Only rows on this chromosome")
+    min_id: Optional[int] = Field(None, description="Only rows with id >= min_id")
+    max_id: Optional[int] = Field(None, description="Only rows with id <= max_id")
+    only_missing: bool = Field(True, description="Only rows that have no packed embedding yet")
+
+def _manager(request: Request):
+    manager = getattr(request.app.state, "job_manager", None)
+    if manager is None:
+        raise HTTPException(status_code=503, detail="Job subsystem is not running.")
+    return manager
+
+@router.post("/file")
+async def submit_file_job(request: Request, file: UploadFile = File(...),
+                          ingest: bool = Query(False, description="Also insert the embedded rows into exon_embeddings")):
+    """
+    Embed a TSV with 'id' and 'secondary_structure' columns in the background.
+    """
+    manager = _manager(request)
+    job_id = manager.new_job_id()
+    path = manager.input_path(job_id)
+    
+    def save_upload():
+        with open(path, "wb") as out:
+            shutil.copyfileobj(file.file, out, 1 << 20)
+    
+    await run_in_threadpool(save_upload)
+    try:
+        return await run_in_threadpool(manager.submit_file, job_id, ingest)
+    except (ValueError, UnicodeDecodeError) as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/db")
+def submit_db_job(request: Request, selection: DBJobRequest):
+    """
+    (Re-)embed the rna_ss of a selection of exon_embeddings rows in the background.
+    """
+    return _manager(request).submit_db_selection(chr=selection.chr, min_id=selection.min_id,
+                                                 max_id=selection.max_id, only_missing=selection.only_missing)
+
+@router.get("/{job_id}")
+def job_status(request: Request, job_id: str):
+    job = _manager(request).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.get("/{job_id}/results")
+def job_results(request: Request, job_id: str):
+    manager = _manager(request)
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["kind"] != "file":
+        raise HTTPException(status_code=400, detail="Results of database jobs are written to exon_embeddings.")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+    return FileResponse(manager.output_path(job_id), media_type="text/tab-separated-values",
+                        filename=f"{job_id}.tsv")
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Request, Response
+
+from api.utils.metrics import REGISTRY, render_gauges
+
+router = APIRouter()
+
+@router.get("/metrics")
+def metrics(request: Request):
+    """
+    Request, stage and inference metrics in Prometheus text format, plus the
+    current stats of the micro-batcher, embedding cache and search index.
+    """
+    state = request.app.state
+    parts = [REGISTRY.render()]
+    batcher = getattr(state, "embedding_batcher", None)
+    if batcher is not None:
+        parts.append(render_gauges("ginfinity_batcher", batcher.stats()))
+    cache = getattr(state, "embedding_cache", None)
+    if cache is not None:
+        parts.append(render_gauges("ginfinity_cache", cache.stats()))
+    index = getattr(state, "search_index", None)
+    if index is not None:
+        parts.append(render_gauges("ginfinity_search_index", index.stats()))
+    return Response(content="".join(parts), media_type="text/plain; version=0.0.4")
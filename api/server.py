@@ -0,0 +1,116 @@
+"""
+Multi-worker server.
+
+    python -m api.server --workers 4 --host 0.0.0.0 --port 8000
+
+With more than one worker, this parent process loads the model weights and
+the search index once, exports them to a SharedStateStore (on /dev/shm by
+default) and starts uvicorn with SHARED_STATE_DIR pointing at it. Workers map
+the exported files instead of loading their own copies. The parent keeps
+refreshing the index from the database and publishes each refresh as a new
+snapshot generation, which every worker switches to as a whole.
+
+Index memory: workers share the mapped pages of the current generation in
+/dev/shm, and the previous generation stays there until the next publish.
+The parent keeps its own copy in growable buffers (up to twice the rows
+loaded) so that a refresh only appends the new rows; with a large table,
+budget about 4x the matrix size in total.
+
+With a single worker it simply runs uvicorn on api.main:app.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import uvicorn
+
+from api.models import load_model
+from api.utils.cache import checkpoint_hash
+from api.utils.search_index import EmbeddingIndex
+from api.utils.shared_state import SharedStateStore
+from config.settings import API_WORKERS, MODEL_PATH, SHARED_STATE_DIR, TORCH_NUM_THREADS
+from config.settings import SEARCH_INDEX_MODE, SEARCH_IVF_NLIST, SEARCH_IVF_NPROBE, SEARCH_INDEX_REFRESH_SECONDS, SEARCH_LENGTH_BUCKET
+from config.settings import DATABASE_STREAM_CHUNK_SIZE
+from db.connection import SessionLocal
+
+logger = logging.getLogger("api.server")
+
+
+def _refresh_and_publish(index, store):
+    with SessionLocal() as db:
+        added = index.refresh(db)
+    # Trained here, off the request path, so published snapshots carry the IVF lists
+    trained = index.mode == "ivf" and index.stats()["rows"] and not index.has_ivf
+    if trained:
+        index.train_ivf()
+    if added or (trained and index.has_ivf):
+        generation = index.publish(store)
+        logger.info("Published search index generation %d (%d rows, %d new)", generation, len(index), added)
+
+
+def _refresh_loop(index, store, interval, stop):
+    while not stop.wait(interval):
+        try:
+            _refresh_and_publish(index, store)
+        except Exception:
+            logger.exception("Search index refresh failed; workers keep the previous snapshot")
+
+
+def _prepare_shared_state(store):
+    """
+    Export the model and the first index snapshot before any worker starts.
+    """
+    # Exported on CPU so the workers can map the weights; they move them to their device
+    model = load_model(MODEL_PATH, "cpu")
+    store.export_model(model, checkpoint_hash(MODEL_PATH))
+    del model
+
+    index = EmbeddingIndex(mode=SEARCH_INDEX_MODE, nlist=SEARCH_IVF_NLIST, nprobe=SEARCH_IVF_NPROBE,
+                           refresh_seconds=SEARCH_INDEX_REFRESH_SECONDS, length_bucket=SEARCH_LENGTH_BUCKET,
+                           load_chunk_size=DATABASE_STREAM_CHUNK_SIZE, train_in_background=False)
+    _refresh_and_publish(index, store)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the RNA Similarity API with workers sharing one model and index.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    if args.workers <= 1:
+        uvicorn.run("api.main:app", host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    # Split the cores between workers instead of letting each one use all of them
+    if TORCH_NUM_THREADS <= 0:
+        os.environ["TORCH_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // args.workers))
+
+    directory = SHARED_STATE_DIR
+    owned = not directory
+    if owned:
+        directory = tempfile.mkdtemp(prefix="ginfinity-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    store = SharedStateStore(directory)
+    stop = threading.Event()
+    try:
+        index = _prepare_shared_state(store)
+        refresher = threading.Thread(target=_refresh_loop, args=(index, store, SEARCH_INDEX_REFRESH_SECONDS, stop),
+                                     name="search-index-refresh", daemon=True)
+        refresher.start()
+        # Spawned workers inherit the environment and attach to the store on import
+        os.environ["SHARED_STATE_DIR"] = directory
+        uvicorn.run("api.main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+    finally:
+        stop.set()
+        if owned:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _bucket(size):
+    """
+    Round a batch size up to the next power of two for the histogram.
+    """
+    bucket = 1
+    while bucket < size:
+        bucket *= 2
+    return bucket
+
+
+class EmbeddingBatcher:
+    """
+    In-process request coalescer for single-structure endpoints.
+
+    Callers submit structures with `submit`; a background task collects them
+    from a queue and flushes them as one call to `embed_fn` once either
+    `max_batch_size` items are waiting or `max_wait_ms` has passed since the
+    first item of the batch arrived. Each caller's future is resolved with the
+    result for its own structure.
+
+    `embed_fn` receives a list of structures and must return one result per
+    structure, in order. It runs on a single dedicated thread so inference
+    never blocks the event loop and batches never run concurrently.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.batch_size_histogram = Counter()
+        self.batches_run = 0
+        self.items_processed = 0
+        self._queue = None
+        self._worker = None
+        self._executor = None
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-batcher")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # Fail anything still waiting so no caller hangs forever
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Embedding batcher stopped"))
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    async def submit(self, structure):
+        """
+        Queue a single structure and wait for its result.
+        """
+        if self._worker is None:
+            raise RuntimeError("Embedding batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((structure, future))
+        return await future
+
+    async def submit_many(self, structures):
+        """
+        Queue several structures at once; they may be spread over several batches.
+        """
+        return list(await asyncio.gather(*(self.submit(s) for s in structures)))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_run": self.batches_run,
+            "items_processed": self.items_processed,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+        }
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Skip callers that went away while waiting
+            batch = [(s, f) for s, f in batch if not f.cancelled()]
+            if not batch:
+                continue
+            structures = [s for s, _ in batch]
+            self.batches_run += 1
+            self.items_processed += len(batch)
+            self.batch_size_histogram[_bucket(len(batch))] += 1
+            try:
+                results = await loop.run_in_executor(self._executor, self.embed_fn, structures)
+            except Exception:
+                # One bad structure must not fail everyone else in the batch,
+                # so fall back to running the items one by one
+                for structure, future in batch:
+                    try:
+                        result = (await loop.run_in_executor(self._executor, self.embed_fn, [structure]))[0]
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                        continue
+                    if not future.done():
+                        future.set_result(result)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
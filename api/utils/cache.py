@@ -0,0 +1,166 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from api.utils.embedding import get_gin_embedding
+from api.utils.postprocess import pack_embedding, unpack_embedding
+
+
+def checkpoint_hash(model_path, chunk_size=1 << 20):
+    """
+    SHA-256 of a checkpoint file. Used as part of every cache key so that
+    cached embeddings are never served for a different set of weights.
+    """
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with two tiers:
+    a bounded in-memory LRU and an optional SQLite file that survives restarts.
+
+    Keys are derived from the structure, the graph encoding, the window
+    parameters (L, keep_paired_neighbors) and the checkpoint hash. Rows on disk
+    written for another checkpoint are dropped when the cache is opened, so
+    pointing MODEL_PATH at new weights invalidates the cache automatically.
+    """
+
+    def __init__(self, model_hash, max_items=10000, disk_path=None):
+        self.model_hash = model_hash
+        self.max_items = max(0, int(max_items))
+        self.disk_path = disk_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, path):
+        self._disk = sqlite3.connect(path, check_same_thread=False)
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key TEXT PRIMARY KEY, model_hash TEXT NOT NULL, starts TEXT NOT NULL, dim INTEGER NOT NULL, value BLOB NOT NULL)"
+        )
+        self._disk.execute("DELETE FROM embedding_cache WHERE model_hash != ?", (self.model_hash,))
+        self._disk.commit()
+
+    def make_key(self, structure, graph_encoding, L=None, keep_paired_neighbors=False):
+        raw = f"{self.model_hash}|{graph_encoding}|{L}|{int(bool(keep_paired_neighbors))}|{structure}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _dump(value):
+        # Window starts as JSON, all vectors packed back to back as float32
+        starts = json.dumps([start for start, _ in value])
+        dim = len(value[0][1]) if value else 0
+        packed = b"".join(pack_embedding(vector) for _, vector in value)
+        return starts, dim, packed
+
+    @staticmethod
+    def _load(starts, dim, packed):
+        starts = json.loads(starts)
+        vectors = unpack_embedding(packed).reshape(len(starts), dim) if dim else [np.empty(0, dtype=np.float32)] * len(starts)
+        return [(start, vector) for start, vector in zip(starts, vectors)]
+
+    def _remember(self, key, value):
+        if self.max_items == 0:
+            return
+        # Vectors usually are row views of a whole batch's output; owning copies
+        # keep an entry from pinning that (B, D) array for as long as it is cached
+        value = [(start, np.array(vector, dtype=np.float32, copy=True)) for start, vector in value]
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._disk is not None:
+                row = self._disk.execute("SELECT starts, dim, value FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = self._load(*row)
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put_many(self, items):
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            if self._disk is not None:
+                self._disk.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (key, model_hash, starts, dim, value) VALUES (?, ?, ?, ?, ?)",
+                    [(key, self.model_hash, *self._dump(value)) for key, value in items],
+                )
+                self._disk.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM embedding_cache")
+                self._disk.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "max_items": self.max_items,
+            "disk_path": self.disk_path,
+        }
+
+
+def get_cached_gin_embedding(cache, model, graph_encoding, structures, device, L=None, keep_paired_neighbors=False, batch_size=1, cpus=1, pipeline=None,
+                             max_batch_nodes=None):
+    """
+    Drop-in replacement for get_gin_embedding that serves repeated structures
+    from `cache` and only embeds the misses. With cache=None it simply calls
+    get_gin_embedding.
+    """
+    if cache is None:
+        return get_gin_embedding(model, graph_encoding, structures, device, L=L, keep_paired_neighbors=keep_paired_neighbors,
+                                 batch_size=batch_size, cpus=cpus, pipeline=pipeline, max_batch_nodes=max_batch_nodes)
+    if not isinstance(structures, list):
+        structures = [structures]
+    
+    keys = [cache.make_key(s, graph_encoding, L, keep_paired_neighbors) for s in structures]
+    results = [cache.get(key) for key in keys]
+    # Embed each missing structure only once, even if it repeats in the request
+    missing = {}
+    for idx, (key, result) in enumerate(zip(keys, results)):
+        if result is None:
+            missing.setdefault(key, []).append(idx)
+    if missing:
+        miss_structures = [structures[positions[0]] for positions in missing.values()]
+        computed = get_gin_embedding(model, graph_encoding, miss_structures, device, L=L, keep_paired_neighbors=keep_paired_neighbors,
+                                     batch_size=batch_size, cpus=cpus, pipeline=pipeline, max_batch_nodes=max_batch_nodes)
+        cache.put_many(list(zip(missing.keys(), computed)))
+        for positions, result in zip(missing.values(), computed):
+            for idx in positions:
+                results[idx] = result
+    return results
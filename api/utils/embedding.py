@@ -1,4 +1,9 @@
+import numpy as np
 import torch
+from torch_geometric.data import Batch
+
+from api.utils.metrics import stage, INFERENCE_BATCH_SIZE, INFERENCE_BATCH_NODES, STRUCTURES_EMBEDDED, DUPLICATE_STRUCTURES
+from api.utils.planner import BatchPlan, split_batches
 
 from external.GINFINITY.src.utils import (
     dotbracket_to_graph,
@@ -23,54 +28,120 @@ def convert_structure_to_graph(structure, graph_encoding, device):
     tg = tg.to(device)
     return graph, tg
 
-def get_gin_embedding(model, graph_encoding, structures, device, L=None, keep_paired_neighbors=False, batch_size=1, cpus=1):
+# Placeholder embedding for structures that produce no windows
+EMPTY_EMBEDDING = np.empty(0, dtype=np.float32)
+
+def _embed_graph_batch(model, graphs, device):
+    """
+    Collate a list of graph tensors into a single torch-geometric Batch and run
+    one forward pass. Pooling is done per graph through the batch vector, so each
+    row of the result matches calling forward_once on that graph alone.
+    """
+    batch = Batch.from_data_list(graphs).to(device)
+    with torch.inference_mode():
+        embeddings = model.forward_once(batch)
+    return embeddings.cpu().numpy().astype(np.float32, copy=False)
+
+def _embed_windows(model, graph, tg, device, L, keep_paired_neighbors):
+    """
+    Embed every sliding window (subgraph of L nodes) of one structure.
+    Node embeddings are computed once for the whole graph; all windows are then
+    pooled together in one scatter-style pooling call, using a window index as
+    the batch vector, and fc runs once over the stacked pooled windows.
+    
+    Returns:
+        List of tuples (start_idx, embedding), or [(-1, EMPTY_EMBEDDING)] if the
+        structure is shorter than L or yields no windows.
+    """
+    if graph.number_of_nodes() < L:
+        return [(-1, EMPTY_EMBEDDING)]
+    # Position of every node in the node embedding matrix, looked up in O(1)
+    node_index = {node: i for i, node in enumerate(sorted(graph.nodes()))}
+    starts, node_indices, window_ids = [], [], []
+    for start_idx, subgraph_H in generate_slices(graph, L, keep_paired_neighbors):
+        indices = [node_index[node] for node in sorted(subgraph_H.nodes())]
+        if not indices:
+            continue
+        window_ids.extend([len(starts)] * len(indices))
+        node_indices.extend(indices)
+        starts.append(start_idx)
+    if not starts:
+        return [(-1, EMPTY_EMBEDDING)]
+    
+    with torch.inference_mode():
+        node_embs = model.get_node_embeddings(tg)
+        gather = torch.tensor(node_indices, dtype=torch.long, device=device)
+        window_batch = torch.tensor(window_ids, dtype=torch.long, device=device)
+        pooled = model.pooling(node_embs[gather], window_batch)
+        window_embs = model.fc(pooled).cpu().numpy().astype(np.float32, copy=False)
+    return list(zip(starts, window_embs))
+
+def _iter_graph_batches(structures, graph_encoding, batch_size, pipeline, with_graph):
+    """
+    Yield built graphs for consecutive chunks of structures (batch_size is a
+    chunk size or a list of chunk sizes), from the preprocessing pipeline when
+    one is given, otherwise built inline.
+    """
+    if pipeline is not None:
+        yield from pipeline.iter_batches(structures, batch_size, with_graph=with_graph)
+        return
+    for chunk in split_batches(structures, batch_size):
+        built = [convert_structure_to_graph(structure, graph_encoding, "cpu") for structure in chunk]
+        yield built if with_graph else [tg for _, tg in built]
+
+def get_gin_embedding(model, graph_encoding, structures, device, L=None, keep_paired_neighbors=False, batch_size=1, cpus=1, pipeline=None,
+                      max_batch_nodes=None):
     """
     Given a list of RNA secondary structure strings and a loaded model,
     convert the structures to graphs and compute their embeddings.
-    Processes the structures in batches (batch_size) and sets the number of CPU threads (cpus).
+    Processes the structures in batches (batch_size): each chunk of graphs is
+    collated into one Batch and embedded with a single forward pass.
+    
+    With `max_batch_nodes`, batch_size is ignored and the batches follow a
+    BatchPlan instead: identical structures are embedded once, and the rest are
+    grouped by size into batches of at most max_batch_nodes nodes. Results are
+    still returned in input order.
+    
+    Graph construction runs in `pipeline` (an api.utils.preprocess.GraphPipeline)
+    when given, so it overlaps with inference; otherwise it runs inline.
+    `cpus` is kept for backwards compatibility and no longer changes torch's
+    process-wide thread count, which is set once at startup (TORCH_NUM_THREADS).
+    The model is expected to be in eval mode already (load_model takes care of it).
     
     Returns:
-        List of lists of tuples (start_idx, embedding_str) for each structure.
+        List of lists of tuples (start_idx, embedding) for each structure, where
+        embedding is a 1D float32 numpy array. Use api.utils.postprocess.format_embedding
+        to turn it into text at the API boundary.
     """
     if not isinstance(structures, list):
         structures = [structures]
-    if device == "cpu" and cpus > 1:
-        torch.set_num_threads(cpus)
+    plan = None
+    if max_batch_nodes:
+        plan = BatchPlan(structures, max_batch_nodes)
+        structures, batch_size = plan.structures, plan.batch_sizes
+        DUPLICATE_STRUCTURES.inc(plan.duplicates)
+    else:
+        batch_size = max(1, batch_size)
     
     results = []
-    for i in range(0, len(structures), batch_size):
-        batch_structures = structures[i:i+batch_size]
-        batch_results = []
-        for structure in batch_structures:
-            graph, tg = convert_structure_to_graph(structure, graph_encoding, device)
-            model.eval()
-            with torch.no_grad():
-                if L is not None:
-                    node_embs = model.get_node_embeddings(tg)
-                    sorted_nodes = sorted(graph.nodes())
-                    if len(sorted_nodes) < L:
-                        batch_results.append([(-1, "")])
-                        continue
-                    embeddings = []
-                    slices = generate_slices(graph, L, keep_paired_neighbors)
-                    for start_idx, subgraph_H in slices:
-                        subgraph_nodes = sorted(subgraph_H.nodes())
-                        node_indices = [sorted_nodes.index(node) for node in subgraph_nodes]
-                        if not node_indices:
-                            continue
-                        sub_embs = node_embs[node_indices]
-                        batch_idx = torch.zeros(len(sub_embs), dtype=torch.long, device=device)
-                        pooled = model.pooling(sub_embs, batch_idx)
-                        sub_embedding = model.fc(pooled)
-                        embedding_str = ','.join(f'{x:.6f}' for x in sub_embedding.cpu().numpy().flatten())
-                        embeddings.append((start_idx, embedding_str))
-                    batch_results.append(embeddings if embeddings else [(-1, "")])
-                else:
-                    embedding = model.forward_once(tg)
-                    emb_str = ','.join(f'{x:.6f}' for x in embedding.cpu().numpy().flatten())
-                    batch_results.append([(None, emb_str)])
-        results.extend(batch_results)
-    return results
+    batches = _iter_graph_batches(structures, graph_encoding, batch_size, pipeline, with_graph=L is not None)
+    while True:
+        # With a pipeline this is the time spent waiting for the next batch to be built
+        with stage("graph_construction"):
+            built = next(batches, None)
+        if built is None:
+            break
+        INFERENCE_BATCH_SIZE.observe(len(built))
+        INFERENCE_BATCH_NODES.observe(sum(len(s) for s in structures[len(results):len(results) + len(built)]))
+        STRUCTURES_EMBEDDED.inc(len(built))
+        with stage("forward"):
+            if L is None:
+                # Graphs are built on the CPU and moved to the device once, as a batch
+                embeddings = _embed_graph_batch(model, built, device)
+                results.extend([[(None, emb)] for emb in embeddings])
+            else:
+                results.extend([_embed_windows(model, graph, tg.to(device), device, L, keep_paired_neighbors) for graph, tg in built])
+    return plan.scatter(results) if plan is not None else results
 
 def calculate_query_distances(query_vector, candidate_vectors, metric='squared', batch_size=512):
     """
@@ -85,24 +156,37 @@ def calculate_query_distances(query_vector, candidate_vectors, metric='squared',
     Returns:
         List of distances (floats) corresponding to each candidate vector.
     """
-    query_tensor = torch.tensor(query_vector, dtype=torch.float32)
-    candidate_tensor = torch.tensor(candidate_vectors, dtype=torch.float32)
+    query_tensor = torch.as_tensor(np.asarray(query_vector, dtype=np.float32)).reshape(1, -1)
+    candidate_tensor = torch.as_tensor(np.asarray(candidate_vectors, dtype=np.float32))
     n = candidate_tensor.shape[0]
     distances = []
+    for i in range(0, n, batch_size):
+        batch_candidates = candidate_tensor[i:i+batch_size]
+        distances.extend(pairwise_distances(query_tensor, batch_candidates, metric)[0].tolist())
+    return distances
+
+def pairwise_distances(queries, candidates, metric='squared', candidate_sq_norms=None):
+    """
+    Distance block between a (Q, D) query matrix and an (N, D) candidate matrix,
+    computed with a single matrix multiply.
+    
+    Parameters:
+        queries (torch.Tensor): Query embeddings, shape (Q, D).
+        candidates (torch.Tensor): Candidate embeddings, shape (N, D).
+        metric (str): Either 'squared' or 'cosine'. Default is 'squared'.
+        candidate_sq_norms (torch.Tensor, optional): Precomputed squared L2 norms
+            of the candidate rows, shape (N,).
     
-    from tqdm import tqdm
-    with tqdm(total=n, desc="Calculating distances", unit="row") as pbar:
-        for i in range(0, n, batch_size):
-            batch_candidates = candidate_tensor[i:i+batch_size]
-            if metric == 'cosine':
-                # Normalize query and batch candidates to avoid division by zero
-                q_norm = query_tensor / (query_tensor.norm() + 1e-8)
-                b_norm = batch_candidates / (batch_candidates.norm(dim=1, keepdim=True) + 1e-8)
-                sim = torch.nn.functional.cosine_similarity(b_norm, q_norm.expand_as(batch_candidates), dim=1)
-                batch_distances = (1 - sim).tolist()
-            else:  # squared Euclidean distance
-                diff = batch_candidates - query_tensor
-                batch_distances = torch.sum(diff * diff, dim=1).tolist()
-            distances.extend(batch_distances)
-            pbar.update(len(batch_candidates))
-    return distances
\ No newline at end of file
+    Returns:
+        torch.Tensor of shape (Q, N) with the distance of every query/candidate pair.
+    """
+    if candidate_sq_norms is None:
+        candidate_sq_norms = (candidates * candidates).sum(dim=1)
+    dots = queries @ candidates.T
+    if metric == 'cosine':
+        q_norms = queries.norm(dim=1, keepdim=True) + 1e-8
+        c_norms = candidate_sq_norms.sqrt().unsqueeze(0) + 1e-8
+        return 1 - dots / (q_norms * c_norms)
+    # squared Euclidean distance: |q|^2 - 2 q.c + |c|^2
+    q_sq_norms = (queries * queries).sum(dim=1, keepdim=True)
+    return (q_sq_norms - 2 * dots + candidate_sq_norms.unsqueeze(0)).clamp_min_(0)
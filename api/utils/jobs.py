@@ -0,0 +1,311 @@
+import csv
+import fcntl
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sqlalchemy import func, insert, inspect, select, update
+
+from api.utils.postprocess import format_embedding, pack_embedding
+from db.models import Embedding, EmbeddingJob
+
+# Columns of exon_embeddings that an ingest job may fill from the TSV, with their Python type
+_INGEST_COLUMNS = {
+    col.name: col.type.python_type
+    for col in Embedding.__table__.columns
+    if col.name not in ("id", "embedding_vector", "embedding_packed", "embedding_dtype")
+}
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class JobManager:
+    """
+    Runs long embedding jobs on a background thread pool.
+
+    Two kinds of job are supported:
+
+    - "file": a TSV upload with `id` and `secondary_structure` columns. Results
+      are appended to a TSV on disk and, with ingest=True, rows are also
+      inserted into exon_embeddings.
+    - "db": a selection of exon_embeddings rows whose `rna_ss` is (re-)embedded
+      and written back to the packed embedding column.
+
+    Work is done in chunks of `chunk_size` rows. Each chunk's database writes and
+    the job checkpoint are committed in one transaction, so a job interrupted by
+    a crash or restart resumes after its last committed chunk.
+    """
+
+    def __init__(self, session_factory, embed_fn, validate_fn, data_dir="jobs", workers=1, chunk_size=1000, storage_dtype="float32"):
+        self.session_factory = session_factory
+        self.embed_fn = embed_fn
+        self.validate_fn = validate_fn
+        self.data_dir = data_dir
+        self.workers = max(1, int(workers))
+        self.chunk_size = max(1, int(chunk_size))
+        self.storage_dtype = storage_dtype
+        self._executor = None
+        self._resume_lock = None
+        self._stopping = threading.Event()
+        # Tables created before the packed columns still have a NOT NULL text column
+        self._text_required = False
+
+    def _acquire_resume_lock(self):
+        """
+        Non-blocking exclusive lock held for the life of the process, so that
+        only one worker of a multi-worker server resumes unfinished jobs.
+        """
+        f = open(os.path.join(self.data_dir, ".resume.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def start(self):
+        """
+        Create the job table if needed and resume every unfinished job.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._stopping.clear()
+        self._resume_lock = self._acquire_resume_lock()
+        with self.session_factory() as db:
+            EmbeddingJob.__table__.create(db.get_bind(), checkfirst=True)
+            columns = {col["name"]: col for col in inspect(db.get_bind()).get_columns(Embedding.__tablename__)}
+            self._text_required = "embedding_vector" in columns and not columns["embedding_vector"]["nullable"]
+            pending = []
+            if self._resume_lock is not None:
+                pending = db.scalars(select(EmbeddingJob.id).where(EmbeddingJob.status.in_(("queued", "running")))).all()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding-job")
+        for job_id in pending:
+            self._executor.submit(self._run, job_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            # Running jobs stop after their current chunk and stay "running", so they
+            # resume from the last checkpoint on restart
+            self._stopping.set()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._resume_lock is not None:
+            self._resume_lock.close()
+            self._resume_lock = None
+
+    def input_path(self, job_id):
+        return os.path.join(self.data_dir, f"{job_id}.input.tsv")
+
+    def output_path(self, job_id):
+        return os.path.join(self.data_dir, f"{job_id}.output.tsv")
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def _create(self, job_id, kind, params, total):
+        with self.session_factory() as db:
+            db.add(EmbeddingJob(id=job_id, kind=kind, status="queued", params=json.dumps(params), total=total,
+                                processed=0, failed=0, last_id=-1, output_offset=0))
+            db.commit()
+        self._executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def submit_file(self, job_id, ingest=False):
+        """
+        Queue a job for a TSV already saved at input_path(job_id).
+        """
+        with open(self.input_path(job_id), newline="") as f:
+            reader = csv.reader(f, delimiter="\t")
+            header = next(reader, [])
+            if not {"id", "secondary_structure"}.issubset(header):
+                raise ValueError("TSV must contain 'id' and 'secondary_structure' columns.")
+            total = sum(1 for row in reader if row)
+        return self._create(job_id, "file", {"ingest": bool(ingest)}, total)
+
+    def _selection(self, params):
+        stmt = select(Embedding.id, Embedding.rna_ss)
+        if params.get("only_missing", True):
+            stmt = stmt.where(Embedding.embedding_packed.is_(None))
+        if params.get("chr") is not None:
+            stmt = stmt.where(Embedding.chr == params["chr"])
+        if params.get("min_id") is not None:
+            stmt = stmt.where(Embedding.id >= params["min_id"])
+        if params.get("max_id") is not None:
+            stmt = stmt.where(Embedding.id <= params["max_id"])
+        return stmt
+
+    def submit_db_selection(self, chr=None, min_id=None, max_id=None, only_missing=True):
+        """
+        Queue a job that embeds the rna_ss of the selected exon_embeddings rows.
+        """
+        params = {"chr": chr, "min_id": min_id, "max_id": max_id, "only_missing": only_missing}
+        with self.session_factory() as db:
+            total = db.scalar(select(func.count()).select_from(self._selection(params).subquery()))
+        return self._create(self.new_job_id(), "db", params, total)
+
+    def get(self, job_id):
+        with self.session_factory() as db:
+            job = db.get(EmbeddingJob, job_id)
+            if job is None:
+                return None
+            return {
+                "id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "params": json.loads(job.params or "{}"),
+                "total": job.total,
+                "processed": job.processed,
+                "failed": job.failed,
+                "progress": job.processed / job.total if job.total else (1.0 if job.status == "completed" else 0.0),
+                "error": job.error,
+                "created_at": job.created_at,
+                "updated_at": job.updated_at,
+            }
+
+    def _set_status(self, job_id, status, error=None):
+        with self.session_factory() as db:
+            db.execute(update(EmbeddingJob).where(EmbeddingJob.id == job_id).values(status=status, error=error))
+            db.commit()
+
+    def _run(self, job_id):
+        with self.session_factory() as db:
+            job = db.get(EmbeddingJob, job_id)
+            kind, params = job.kind, json.loads(job.params or "{}")
+        self._set_status(job_id, "running")
+        try:
+            if kind == "file":
+                finished = self._run_file_job(job_id, params)
+            else:
+                finished = self._run_db_job(job_id, params)
+        except Exception as e:
+            self._set_status(job_id, "failed", error=str(e))
+            return
+        if finished:
+            self._set_status(job_id, "completed")
+
+    def _embed_valid(self, structures):
+        """
+        Embed the structures that pass validation; returns (embeddings, errors),
+        with None in place of the embedding of every invalid structure or of
+        every structure the model failed on.
+        """
+        errors = [""] * len(structures)
+        valid = []
+        for idx, structure in enumerate(structures):
+            try:
+                self.validate_fn(structure)
+                valid.append(idx)
+            except Exception as e:
+                errors[idx] = f"Invalid structure: {str(e)}"
+        embeddings = [None] * len(structures)
+        if not valid:
+            return embeddings, errors
+        try:
+            results = self.embed_fn([structures[idx] for idx in valid])
+        except Exception:
+            # One structure that fails in the model must not fail the whole job,
+            # so the chunk is retried row by row and only the failing rows are lost
+            results = []
+            for idx in valid:
+                try:
+                    results.append(self.embed_fn([structures[idx]])[0])
+                except Exception as e:
+                    results.append(None)
+                    errors[idx] = f"Error computing embedding: {str(e)}"
+        for idx, embedding in zip(valid, results):
+            embeddings[idx] = embedding
+        return embeddings, errors
+
+    def _ingest_row(self, header, row, embedding):
+        values = dict(zip(header, row))
+        values.setdefault("rna_ss", values.get("secondary_structure"))
+        values.setdefault("gene_id", values.get("id"))
+        record = {}
+        for name, python_type in _INGEST_COLUMNS.items():
+            value = values.get(name)
+            if value in (None, ""):
+                record[name] = None
+            else:
+                record[name] = int(float(value)) if python_type is int else python_type(value)
+        record["embedding_packed"] = pack_embedding(embedding, self.storage_dtype)
+        record["embedding_dtype"] = self.storage_dtype
+        if self._text_required:
+            record["embedding_vector"] = format_embedding(embedding)
+        return record
+
+    def _run_file_job(self, job_id, params):
+        with self.session_factory() as db:
+            job = db.get(EmbeddingJob, job_id)
+            processed, failed, offset = job.processed, job.failed, job.output_offset
+
+        with open(self.input_path(job_id), newline="") as f_in, \
+                open(self.output_path(job_id), "r+b" if offset else "wb") as f_out:
+            reader = csv.reader(f_in, delimiter="\t")
+            header = next(reader)
+            structure_col = header.index("secondary_structure")
+            id_col = header.index("id")
+            # Drop anything written after the last checkpoint
+            f_out.truncate(offset)
+            f_out.seek(offset)
+            if offset == 0:
+                f_out.write(b"id\tembedding_vector\terror\n")
+
+            rows = (row for row in reader if row)
+            for chunk in _chunks(islice(rows, processed, None), self.chunk_size):
+                if self._stopping.is_set():
+                    return False
+                embeddings, errors = self._embed_valid([row[structure_col] for row in chunk])
+                lines = [f"{row[id_col]}\t{format_embedding(emb) if emb is not None else ''}\t{err}\n"
+                         for row, emb, err in zip(chunk, embeddings, errors)]
+                f_out.write("".join(lines).encode("utf-8"))
+                f_out.flush()
+                os.fsync(f_out.fileno())
+
+                processed += len(chunk)
+                failed += sum(1 for emb in embeddings if emb is None)
+                with self.session_factory() as db:
+                    if params.get("ingest"):
+                        records = [self._ingest_row(header, row, emb) for row, emb in zip(chunk, embeddings) if emb is not None]
+                        if records:
+                            db.execute(insert(Embedding), records)
+                    db.execute(update(EmbeddingJob).where(EmbeddingJob.id == job_id)
+                               .values(processed=processed, failed=failed, output_offset=f_out.tell()))
+                    db.commit()
+        return True
+
+    def _run_db_job(self, job_id, params):
+        with self.session_factory() as db:
+            job = db.get(EmbeddingJob, job_id)
+            processed, failed, last_id = job.processed, job.failed, job.last_id
+
+        while not self._stopping.is_set():
+            with self.session_factory() as db:
+                rows = db.execute(self._selection(params).where(Embedding.id > last_id)
+                                  .order_by(Embedding.id).limit(self.chunk_size)).all()
+                if not rows:
+                    return True
+                embeddings, _ = self._embed_valid([row.rna_ss for row in rows])
+                # The text column is rewritten too (or cleared), so a stale legacy
+                # vector is never returned next to the new packed one
+                updates = [{"id": row.id, "embedding_packed": pack_embedding(emb, self.storage_dtype), "embedding_dtype": self.storage_dtype,
+                            "embedding_vector": format_embedding(emb) if self._text_required else None}
+                           for row, emb in zip(rows, embeddings) if emb is not None]
+                if updates:
+                    db.execute(update(Embedding), updates)
+                processed += len(rows)
+                failed += len(rows) - len(updates)
+                last_id = rows[-1].id
+                db.execute(update(EmbeddingJob).where(EmbeddingJob.id == job_id)
+                           .values(processed=processed, failed=failed, last_id=last_id))
+                db.commit()
+        return False
@@ -0,0 +1,218 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, and size buckets for batch-size histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels, rendered in Prometheus text format.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """
+    Cumulative histogram with optional labels, rendered in Prometheus text format.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def render_gauges(prefix, values, documentation=""):
+    """
+    Render a dict of numeric values (e.g. a component's stats()) as untyped
+    Prometheus gauges named `<prefix>_<key>`. Non-numeric values are skipped.
+    """
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines.append(f"# HELP {name} {documentation or key}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter("ginfinity_requests_total", "HTTP requests handled", ("endpoint", "method", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram("ginfinity_request_seconds", "HTTP request latency", ("endpoint",)))
+STAGE_SECONDS = REGISTRY.register(Histogram("ginfinity_stage_seconds", "Time spent in each processing stage", ("endpoint", "stage")))
+INFERENCE_BATCH_SIZE = REGISTRY.register(Histogram("ginfinity_inference_batch_size", "Graphs per forward pass", buckets=SIZE_BUCKETS))
+STRUCTURES_EMBEDDED = REGISTRY.register(Counter("ginfinity_structures_embedded_total", "Structures run through the model"))
+DUPLICATE_STRUCTURES = REGISTRY.register(Counter("ginfinity_duplicate_structures_total", "Repeated structures in one call, embedded once"))
+INFERENCE_BATCH_NODES = REGISTRY.register(Histogram("ginfinity_inference_batch_nodes", "Estimated graph nodes per forward pass",
+                                                    buckets=(64, 256, 1024, 4096, 16384, 65536, 262144)))
+ROWS_SCANNED = REGISTRY.register(Counter("ginfinity_search_rows_scanned_total", "Index rows scored by searches", ("kind",)))
+
+# Stage timings of the request being handled, if any (set by the metrics middleware)
+_request_timings = contextvars.ContextVar("ginfinity_request_timings", default=None)
+
+
+def record_stage(name, seconds):
+    """
+    Attribute `seconds` to stage `name`. Inside a request it is added to the
+    request's breakdown (observed when the request finishes); otherwise, e.g.
+    in the micro-batcher or job threads, it is observed under endpoint="background".
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        STAGE_SECONDS.observe(seconds, endpoint="background", stage=name)
+    else:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block as processing stage `name`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def staged(iterable, name):
+    """
+    Iterate `iterable`, recording the time spent producing its items (not the
+    time the consumer holds each one) as one stage `name`. Meant for lazily
+    computed response bodies.
+    """
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        record_stage(name, seconds)
+
+
+def begin_request():
+    """
+    Start collecting stage timings for the current request. Returns a token
+    for end_request and the list the timings are appended to.
+    """
+    timings = []
+    return _request_timings.set(timings), timings
+
+
+def end_request(token):
+    """
+    Stop collecting timings in the current context. Code still running for the
+    request, such as a streamed body, keeps appending to its timings list.
+    """
+    _request_timings.reset(token)
+
+
+def observe_request(timings, endpoint, method, status, seconds):
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    for name, stage_seconds in timings:
+        STAGE_SECONDS.observe(stage_seconds, endpoint=endpoint, stage=name)
+
+
+def server_timing(timings, total_seconds):
+    """
+    Server-Timing header value with the summed duration of every stage, in ms.
+    """
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items()]
+    parts.append(f"total;dur={total_seconds * 1000:.3f}")
+    return ", ".join(parts)
@@ -0,0 +1,63 @@
+import numpy as np
+import torch
+
+from api.utils.embedding import pairwise_distances
+from api.utils.postprocess import npy_header
+
+# Row layout of the top-k neighbour output
+NEIGHBOR_DTYPE = np.dtype([("index", "<i4"), ("distance", "<f4")])
+
+
+def _row_blocks(matrix, metric, block_size, start_col=None):
+    """
+    Yield (row_start, distances) for consecutive blocks of rows against all
+    columns (or columns from the block start onwards when start_col is set).
+    Each block is one GEMM over a (block_size, D) slice, so peak memory is
+    block_size * N floats whatever the number of structures.
+    """
+    sq_norms = (matrix * matrix).sum(dim=1)
+    n = matrix.shape[0]
+    for a in range(0, n, block_size):
+        rows = matrix[a:a+block_size]
+        c = a if start_col else 0
+        yield a, pairwise_distances(rows, matrix[c:], metric, sq_norms[c:])
+
+
+def distance_matrix_stream(matrix, metric="squared", mode="full", k=10, block_size=1024):
+    """
+    Compute the all-vs-all distances of `matrix` (N, D) block by block and yield
+    the result as a .npy byte stream:
+
+    - "full":  float32 array of shape (N, N).
+    - "upper": condensed float32 array of the pairs i < j, shape (N*(N-1)/2,),
+      in the same order as scipy.spatial.distance.squareform.
+    - "topk":  structured array (index int32, distance float32) of shape (N, k)
+      with the k nearest other structures of every row, closest first.
+    """
+    matrix = torch.as_tensor(np.asarray(matrix, dtype=np.float32))
+    n = matrix.shape[0]
+    if mode == "full":
+        yield npy_header((n, n), "<f4")
+        for a, block in _row_blocks(matrix, metric, block_size):
+            # The GEMM formulation leaves rounding noise on the diagonal
+            idx = torch.arange(block.shape[0])
+            block[idx, idx + a] = 0
+            yield block.numpy().astype("<f4", copy=False).tobytes()
+    elif mode == "upper":
+        yield npy_header((n * (n - 1) // 2,), "<f4")
+        for a, block in _row_blocks(matrix, metric, block_size, start_col=True):
+            mask = torch.ones(block.shape, dtype=torch.bool).triu_(1)
+            yield block[mask].numpy().astype("<f4", copy=False).tobytes()
+    elif mode == "topk":
+        k = max(0, min(k, n - 1))
+        yield npy_header((n, k), NEIGHBOR_DTYPE)
+        for a, block in _row_blocks(matrix, metric, block_size):
+            idx = torch.arange(block.shape[0])
+            block[idx, idx + a] = float("inf")
+            values, indices = torch.topk(block, k, dim=1, largest=False)
+            out = np.empty(values.shape, dtype=NEIGHBOR_DTYPE)
+            out["index"] = indices.numpy()
+            out["distance"] = values.numpy()
+            yield out.tobytes()
+    else:
+        raise ValueError(f"Unknown pairwise mode: {mode}")
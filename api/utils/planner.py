@@ -0,0 +1,60 @@
+def split_batches(items, batch_size):
+    """
+    Split `items` into consecutive chunks of `batch_size` items, or of the given
+    sizes when `batch_size` is a list (as produced by BatchPlan).
+    """
+    if isinstance(batch_size, int):
+        batch_size = max(1, batch_size)
+        return [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+    chunks, start = [], 0
+    for size in batch_size:
+        chunks.append(items[start:start+size])
+        start += size
+    return chunks
+
+
+class BatchPlan:
+    """
+    Order in which a list of structures is embedded.
+
+    Identical structures are embedded once. The distinct ones are sorted by
+    node count and cut into batches whose total node count stays within
+    `max_batch_nodes`, so small and large graphs are not mixed and the memory
+    of a forward pass is bounded by nodes rather than by the number of
+    structures. A structure larger than the cap gets a batch of its own.
+    The node count of a structure is estimated as its length, which is exact
+    for the standard graph encoding and an upper bound for forgi.
+
+    `structures` is the planned (deduplicated, sorted) list, `batch_sizes` its
+    split into batches, and `scatter` maps results back to the input order.
+    """
+
+    def __init__(self, structures, max_batch_nodes):
+        positions = {}
+        first_seen = [positions.setdefault(structure, len(positions)) for structure in structures]
+        unique = list(positions)
+        order = sorted(range(len(unique)), key=lambda i: len(unique[i]))
+        rank = [0] * len(unique)
+        for planned, i in enumerate(order):
+            rank[i] = planned
+        self.structures = [unique[i] for i in order]
+        self.inverse = [rank[i] for i in first_seen]
+        self.duplicates = len(structures) - len(unique)
+
+        self.batch_sizes = []
+        size = nodes = 0
+        for structure in self.structures:
+            if size and nodes + len(structure) > max_batch_nodes:
+                self.batch_sizes.append(size)
+                size = nodes = 0
+            size += 1
+            nodes += len(structure)
+        if size:
+            self.batch_sizes.append(size)
+
+    def scatter(self, results):
+        """
+        Results for the input structures, given results for self.structures.
+        Duplicates share the same result object.
+        """
+        return [results[i] for i in self.inverse]
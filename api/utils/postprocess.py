@@ -0,0 +1,59 @@
+import numpy as np
+
+# dtypes accepted for packed embedding storage
+PACKED_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+def pack_embedding(vector, dtype="float32"):
+    """
+    Pack an embedding into little-endian bytes for the `embedding_packed` column.
+    """
+    if dtype not in PACKED_DTYPES:
+        raise ValueError(f"Unknown packed dtype: {dtype}")
+    return np.asarray(vector, dtype=np.dtype(PACKED_DTYPES[dtype]).newbyteorder("<")).tobytes()
+
+
+def unpack_embedding(blob, dtype="float32"):
+    """
+    Decode a packed embedding with np.frombuffer. float32 blobs are returned as a
+    read-only view over the bytes (no copy); float16 blobs are widened to float32.
+    """
+    if dtype not in PACKED_DTYPES:
+        raise ValueError(f"Unknown packed dtype: {dtype}")
+    vector = np.frombuffer(blob, dtype=np.dtype(PACKED_DTYPES[dtype]).newbyteorder("<"))
+    return vector.astype(np.float32, copy=False)
+
+
+def format_embedding(vector):
+    """
+    Text form of an embedding (comma-separated, 6 decimals), only used at the API boundary.
+    """
+    return ','.join(f'{x:.6f}' for x in np.asarray(vector).flatten())
+
+
+def parse_embedding(text):
+    """
+    Parse the legacy comma-separated text form back into a float32 array.
+    """
+    return np.array(text.split(','), dtype=np.float32)
+
+
+def npy_header(shape, dtype):
+    """
+    Header of a version 1.0 .npy file, so an array can be streamed as the header
+    followed by its raw C-order bytes without building it in memory first.
+    """
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": tuple(shape)})
+    # Magic (6) + version (2) + length (2) + header must be a multiple of 64, ending in a newline
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header
+
+
+def stored_embedding(record):
+    """
+    Embedding of a database row as a float32 array, preferring the packed column.
+    """
+    if getattr(record, "embedding_packed", None) is not None:
+        return unpack_embedding(record.embedding_packed, record.embedding_dtype or "float32")
+    return parse_embedding(record.embedding_vector)
@@ -0,0 +1,67 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from api.utils.embedding import convert_structure_to_graph
+from api.utils.planner import split_batches
+
+
+def _build_graphs(structures, graph_encoding, with_graph):
+    """
+    Worker function: convert structures to graph tensors on the CPU.
+    Returns (graph, tensor) pairs when with_graph is set, otherwise tensors only.
+    """
+    built = [convert_structure_to_graph(structure, graph_encoding, "cpu") for structure in structures]
+    return built if with_graph else [tg for _, tg in built]
+
+
+class GraphPipeline:
+    """
+    Producer side of the embedding pipeline.
+
+    A process pool converts dot-bracket structures into graph tensors (pure
+    Python networkx/forgi work) ahead of time, while the caller runs the model
+    on batches that are already built. Up to `prefetch` batches are in flight,
+    each one split across the workers, so CPU preprocessing of the next batches
+    overlaps with inference on the current one.
+    """
+
+    def __init__(self, graph_encoding, workers=2, prefetch=2, min_parallel=8, start_method="spawn"):
+        self.graph_encoding = graph_encoding
+        self.workers = max(1, int(workers))
+        self.prefetch = max(1, int(prefetch))
+        self.min_parallel = min_parallel
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context(start_method))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, structures, with_graph):
+        if len(structures) < self.min_parallel:
+            # Too small to be worth the round trip through the pool
+            return None, _build_graphs(structures, self.graph_encoding, with_graph)
+        step = -(-len(structures) // self.workers)
+        return [self._executor.submit(_build_graphs, structures[i:i+step], self.graph_encoding, with_graph)
+                for i in range(0, len(structures), step)], None
+
+    def iter_batches(self, structures, batch_size, with_graph=False):
+        """
+        Yield the built graphs for consecutive chunks of `batch_size` structures
+        (or of each size in a list of batch sizes), in order.
+        """
+        chunks = iter(split_batches(structures, batch_size))
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(self._submit(chunk, with_graph))
+            if len(in_flight) >= self.prefetch:
+                break
+        while in_flight:
+            futures, built = in_flight.popleft()
+            if futures is not None:
+                built = [graph for future in futures for graph in future.result()]
+            # Keep the pool busy before handing this batch to the model
+            chunk = next(chunks, None)
+            if chunk is not None:
+                in_flight.append(self._submit(chunk, with_graph))
+            yield built
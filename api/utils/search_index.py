@@ -0,0 +1,560 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+from api.utils.embedding import pairwise_distances
+from api.utils.metrics import ROWS_SCANNED
+from api.utils.postprocess import stored_embedding
+from db.repository import scoring_chunks, vectors_rewritten_at
+
+
+def _decode(row):
+    # Empty or malformed stored vectors are skipped rather than failing the whole load
+    try:
+        vec = stored_embedding(row)
+    except (AttributeError, ValueError):
+        return None
+    return vec if len(vec) else None
+
+
+def _encode(categories, values):
+    # Categorical int32 codes for `values`; unseen values are appended to `categories`
+    codes = {value: code for code, value in enumerate(categories)}
+    out = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value not in codes:
+            codes[value] = len(categories)
+            categories.append(value)
+        out[i] = codes[value]
+    return out
+
+
+def _flatten(lists):
+    # Variable-length row lists as offsets into one concatenated array, so they can be saved as .npy
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(rows) for rows in lists])
+    rows = np.concatenate(lists).astype(np.int64, copy=False) if len(lists) else np.empty(0, dtype=np.int64)
+    return offsets, rows
+
+
+def _unflatten(offsets, rows):
+    return [rows[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+
+class _Buffer:
+    """
+    Append-only array with spare capacity, grown by doubling, so appending m
+    rows copies O(m) data instead of the whole array. Snapshots hold views of
+    the first rows, which later appends never write to.
+    """
+
+    def __init__(self, array):
+        self.data = array
+        self.size = len(array)
+
+    def append(self, rows):
+        needed = self.size + len(rows)
+        if needed > len(self.data):
+            grown = np.empty((max(needed, 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = rows
+        self.size = needed
+        return self.data[:needed]
+
+
+class _IVFPartition:
+    """
+    Inverted-file partition of the index rows: k-means centroids plus, for
+    every centroid, the positions of the rows assigned to it. Searching only
+    the `nprobe` closest lists trades recall for speed.
+    """
+
+    def __init__(self, centroids, assignments):
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignments == c) for c in range(len(centroids))]
+
+    @classmethod
+    def from_lists(cls, centroids, lists):
+        partition = cls.__new__(cls)
+        partition.centroids = centroids
+        partition.lists = lists
+        return partition
+
+    @classmethod
+    def train(cls, matrix, nlist, iterations=10, sample_size=None, max_sample_size=131072, seed=0):
+        n = matrix.shape[0]
+        generator = torch.Generator().manual_seed(seed)
+        # k-means only needs a few dozen points per centroid; the cap bounds training time and memory
+        sample_size = min(n, sample_size or 64 * nlist, max_sample_size)
+        sample = matrix[torch.randperm(n, generator=generator)[:sample_size]]
+        centroids = sample[torch.randperm(sample_size, generator=generator)[:nlist]].clone()
+        for _ in range(iterations):
+            assign = torch.from_numpy(cls.assign(centroids, sample))
+            sums = torch.zeros_like(centroids).index_add_(0, assign, sample)
+            counts = torch.bincount(assign, minlength=len(centroids)).unsqueeze(1)
+            # Keep the previous centroid for clusters that lost all their points
+            centroids = torch.where(counts > 0, sums / counts.clamp_min(1), centroids)
+        return cls(centroids, cls.assign(centroids, matrix))
+
+    @staticmethod
+    def assign(centroids, matrix, block_elements=1 << 24):
+        # Rows per chunk so that each (chunk, nlist) distance block stays around 64 MB
+        chunk_size = max(1, block_elements // max(1, len(centroids)))
+        parts = [pairwise_distances(matrix[i:i+chunk_size], centroids).argmin(dim=1)
+                 for i in range(0, matrix.shape[0], chunk_size)]
+        return torch.cat(parts).numpy() if parts else np.empty(0, dtype=np.int64)
+
+    def add(self, matrix, offset):
+        """
+        Return a new partition with `matrix` (rows starting at `offset`) assigned
+        to the existing centroids. The current partition is left untouched because
+        searches may still be reading it.
+        """
+        assignments = self.assign(self.centroids, matrix)
+        lists = list(self.lists)
+        for c in np.unique(assignments):
+            new_rows = np.flatnonzero(assignments == c) + offset
+            lists[c] = np.concatenate([lists[c], new_rows])
+        return _IVFPartition.from_lists(self.centroids, lists)
+
+    def candidates(self, query, nprobe, metric):
+        nprobe = min(nprobe, len(self.centroids))
+        nearest = torch.topk(pairwise_distances(query, self.centroids, metric), nprobe, largest=False).indices[0]
+        return np.sort(np.concatenate([self.lists[c] for c in nearest.tolist()]))
+
+
+class _Snapshot:
+    """
+    Immutable view of the index. A refresh builds a new snapshot and swaps it in
+    as a whole, so readers never see a partially updated index.
+    """
+
+    def __init__(self, matrix, sq_norms, ids, meta, partitions, ivf=None, categories=None):
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+        self.ids = ids
+        # Metadata columns aligned with the matrix rows: chr and strand as int32 codes
+        # into `categories`, seq_len and paired_ratio as float (NaN for NULL)
+        self.meta = meta
+        # Distinct chr and strand values, in code order
+        self.categories = categories or {"chr": [], "strand": []}
+        # (chr code, length bucket) -> sorted row positions
+        self.partitions = partitions
+        self.ivf = ivf
+
+    @classmethod
+    def empty(cls):
+        meta = {"chr": np.empty(0, dtype=np.int32), "strand": np.empty(0, dtype=np.int32),
+                "seq_len": np.empty(0), "paired_ratio": np.empty(0)}
+        return cls(torch.empty(0, 0), torch.empty(0), np.empty(0, dtype=np.int64), meta, {})
+
+    def code(self, column, value):
+        """
+        Code of `value` in the categorical column `column`, or None if no row has it.
+        """
+        try:
+            return self.categories[column].index(value)
+        except ValueError:
+            return None
+
+    def save(self, directory):
+        """
+        Write the snapshot to `directory` as .npy files that can be memory-mapped.
+        Partitions and IVF lists are flattened into offsets plus one array of row
+        positions; only the categorical values go to a small JSON file.
+        """
+        def save(name, array):
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        save("matrix", self.matrix.numpy())
+        save("sq_norms", self.sq_norms.numpy())
+        save("ids", self.ids)
+        for name, column in self.meta.items():
+            save(f"meta_{name}", column)
+        keys = list(self.partitions)
+        save("partition_keys", np.asarray(keys, dtype=np.int64).reshape(len(keys), 2))
+        for name, array in zip(("partition_offsets", "partition_rows"), _flatten([self.partitions[key] for key in keys])):
+            save(name, array)
+        if self.ivf is not None:
+            save("ivf_centroids", self.ivf.centroids.numpy())
+            for name, array in zip(("ivf_offsets", "ivf_rows"), _flatten(self.ivf.lists)):
+                save(name, array)
+        with open(os.path.join(directory, "state.json"), "w") as f:
+            json.dump({"meta": list(self.meta), "categories": self.categories, "ivf": self.ivf is not None}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Map a snapshot written by save(). Copy-on-write mapping keeps the pages
+        shared between processes while giving torch a writable array; partition
+        and IVF lists are views into the mapped row arrays.
+        """
+        def mapped(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="c")
+        with open(os.path.join(directory, "state.json")) as f:
+            state = json.load(f)
+        meta = {name: mapped(f"meta_{name}") for name in state["meta"]}
+        keys = [tuple(key) for key in mapped("partition_keys").tolist()]
+        partitions = dict(zip(keys, _unflatten(mapped("partition_offsets"), mapped("partition_rows"))))
+        ivf = None
+        if state["ivf"]:
+            ivf = _IVFPartition.from_lists(torch.from_numpy(mapped("ivf_centroids")),
+                                           _unflatten(mapped("ivf_offsets"), mapped("ivf_rows")))
+        return cls(torch.from_numpy(mapped("matrix")), torch.from_numpy(mapped("sq_norms")), mapped("ids"),
+                   meta, partitions, ivf, state["categories"])
+
+
+class EmbeddingIndex:
+    """
+    In-memory vector index over `exon_embeddings`.
+
+    The table is loaded once into a contiguous float32 matrix with a parallel
+    id array, and exact top-k is served with one GEMM plus `torch.topk`.
+    With mode="ivf" an inverted-file partition is trained on the matrix and
+    only the `nprobe` nearest partitions are scored (approximate search, higher
+    nprobe means higher recall). Training runs outside the index lock, on a
+    background thread unless `train_in_background` is False (then `train_ivf`
+    is called by the owner); searches stay exact until it is ready. `refresh` only fetches rows with an id larger
+    than the last one loaded.
+
+    Rows are also partitioned by chromosome and sequence length bucket
+    (`length_bucket` nucleotides wide). Metadata filters are resolved against
+    these partitions and the cached metadata columns first, so a filtered query
+    only scores the matching rows.
+
+    With a `shared_store` (workers of a multi-worker server) the index never
+    reads the database: it maps the snapshots that the parent process
+    publishes with `publish` and switches to each new one as a whole.
+    """
+
+    def __init__(self, mode="exact", nlist=0, nprobe=8, refresh_seconds=30.0, load_chunk_size=10000, length_bucket=100,
+                 shared_store=None, train_in_background=True):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown search index mode: {mode}")
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.refresh_seconds = refresh_seconds
+        self.load_chunk_size = load_chunk_size
+        self.length_bucket = max(1, int(length_bucket))
+        self.shared_store = shared_store
+        self.generation = None
+        self.last_refresh = None
+        self._rewritten_at = None
+        self.train_in_background = train_in_background
+        self._training = False
+        # Growable arrays behind the current snapshot's matrix, norms, ids and metadata
+        self._buffers = None
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot.empty()
+
+    def __len__(self):
+        return len(self._snapshot.ids)
+
+    @property
+    def has_ivf(self):
+        return self._snapshot.ivf is not None
+
+    @property
+    def dim(self):
+        return self._snapshot.matrix.shape[1]
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "mode": self.mode,
+            "rows": len(snap.ids),
+            "dim": snap.matrix.shape[1],
+            "partitions": len(snap.partitions),
+            "matrix_bytes": snap.matrix.element_size() * snap.matrix.nelement(),
+            "seconds_since_refresh": time.monotonic() - self.last_refresh if self.last_refresh is not None else -1.0,
+            "generation": self.generation if self.generation is not None else -1,
+        }
+
+    def _fetch(self, db, after_id, categories, dim=None):
+        """
+        Stream the rows added after `after_id` in scoring mode and decode them one
+        chunk at a time, so only the packed vectors of the current chunk are held
+        as Python objects. Rows that cannot be decoded, or whose dimension differs
+        from `dim` (or from the first decodable row, when the index is empty), are skipped.
+        chr and strand are encoded against `categories`, which new values are added to.
+        Returns (matrix, ids, meta) for the new rows, or None if there are none.
+        """
+        matrices, ids, meta = [], [], {"chr": [], "strand": [], "seq_len": [], "paired_ratio": []}
+        for rows in scoring_chunks(db, after_id, self.load_chunk_size):
+            vectors = [_decode(row) for row in rows]
+            if dim is None:
+                dim = next((len(vec) for vec in vectors if vec is not None), None)
+            keep = [i for i, vec in enumerate(vectors) if vec is not None and len(vec) == dim]
+            if not keep:
+                continue
+            matrices.append(np.stack([vectors[i] for i in keep]))
+            ids.append(np.asarray([rows[i].id for i in keep], dtype=np.int64))
+            meta["chr"].append(_encode(categories["chr"], [rows[i].chr for i in keep]))
+            meta["strand"].append(_encode(categories["strand"], [rows[i].strand for i in keep]))
+            meta["seq_len"].append(np.asarray([np.nan if rows[i].seq_len is None else rows[i].seq_len for i in keep], dtype=np.float64))
+            meta["paired_ratio"].append(np.asarray([np.nan if rows[i].paired_ratio is None else rows[i].paired_ratio for i in keep],
+                                                   dtype=np.float64))
+        if not ids:
+            return None
+        return (torch.from_numpy(np.concatenate(matrices)), np.concatenate(ids),
+                {name: np.concatenate(parts) for name, parts in meta.items()})
+
+    def _bucket(self, seq_len):
+        # -1 for rows without a length, so partition keys stay integers
+        return -1 if np.isnan(seq_len) else int(seq_len) // self.length_bucket
+
+    def refresh(self, db, full=False):
+        """
+        Load rows added since the last refresh (or the whole table with full=True).
+        The whole table is also reloaded after a /jobs/db job has rewritten
+        vectors of existing rows, which an id-based incremental load cannot see.
+        Returns the number of rows added.
+        """
+        added = self._load(db, full)
+        if self.train_in_background and self._start_training():
+            threading.Thread(target=self.train_ivf, name="ivf-training", daemon=True).start()
+        return added
+
+    def _start_training(self):
+        with self._lock:
+            if self.mode != "ivf" or self._training or self._snapshot.ivf is not None or len(self._snapshot.ids) == 0:
+                return False
+            self._training = True
+            return True
+
+    def _load(self, db, full):
+        with self._lock:
+            rewritten_at = vectors_rewritten_at(db)
+            if rewritten_at != self._rewritten_at:
+                full = True
+                self._rewritten_at = rewritten_at
+            snap = self._snapshot
+            if full or len(snap.ids) == 0:
+                snap = _Snapshot.empty()
+            after_id = int(snap.ids[-1]) if len(snap.ids) else -1
+            # Rows whose dimension does not match the index are skipped, as before
+            categories = {name: list(values) for name, values in snap.categories.items()}
+            fetched = self._fetch(db, after_id, categories, dim=snap.matrix.shape[1] if len(snap.ids) else None)
+            self.last_refresh = time.monotonic()
+            if fetched is None:
+                self._snapshot = snap
+                return 0
+            new_matrix, new_ids, new_meta = fetched
+            
+            offset = len(snap.ids)
+            new_columns = {"matrix": new_matrix.numpy(), "sq_norms": (new_matrix * new_matrix).sum(dim=1).numpy(),
+                           "ids": new_ids, **{f"meta_{name}": new_meta[name] for name in snap.meta}}
+            buffers = self._buffers
+            if not offset:
+                buffers = {name: _Buffer(np.ascontiguousarray(column)) for name, column in new_columns.items()}
+            else:
+                if buffers is None or buffers["ids"].size != offset:
+                    # First append to a snapshot that was not built here: one copy into growable buffers
+                    buffers = {"matrix": _Buffer(snap.matrix.numpy()), "sq_norms": _Buffer(snap.sq_norms.numpy()),
+                               "ids": _Buffer(snap.ids), **{f"meta_{name}": _Buffer(snap.meta[name]) for name in snap.meta}}
+                for name, column in new_columns.items():
+                    buffers[name].append(column)
+            self._buffers = buffers
+            views = {name: buffer.data[:buffer.size] for name, buffer in buffers.items()}
+            matrix, sq_norms, ids = torch.from_numpy(views["matrix"]), torch.from_numpy(views["sq_norms"]), views["ids"]
+            meta = {name: views[f"meta_{name}"] for name in snap.meta}
+            
+            partitions = dict(snap.partitions)
+            new_keys = {}
+            for pos, (chrom, seq_len) in enumerate(zip(new_meta["chr"], new_meta["seq_len"])):
+                new_keys.setdefault((chrom, self._bucket(seq_len)), []).append(offset + pos)
+            for key, positions in new_keys.items():
+                existing = partitions.get(key, np.empty(0, dtype=np.int64))
+                partitions[key] = np.concatenate([existing, np.asarray(positions, dtype=np.int64)])
+            
+            ivf = snap.ivf
+            if ivf is not None and len(new_ids):
+                ivf = ivf.add(new_matrix, offset)
+            self._snapshot = _Snapshot(matrix, sq_norms, ids, meta, partitions, ivf, categories)
+            return len(new_ids)
+
+    def train_ivf(self):
+        """
+        Train the IVF partition on the current snapshot without holding the lock,
+        then install it on the latest snapshot (assigning rows added meanwhile).
+        """
+        if self.mode != "ivf":
+            return
+        try:
+            snap = self._snapshot
+            if len(snap.ids) == 0 or snap.ivf is not None:
+                return
+            nlist = self.nlist or max(1, int(np.sqrt(len(snap.ids))))
+            ivf = _IVFPartition.train(snap.matrix, min(nlist, len(snap.ids)))
+            with self._lock:
+                current = self._snapshot
+                n = len(snap.ids)
+                # A full reload in the meantime may have reordered rows; retrain on the next refresh
+                if current.ivf is not None or len(current.ids) < n or not np.array_equal(current.ids[:n], snap.ids):
+                    return
+                if len(current.ids) > n:
+                    ivf = ivf.add(current.matrix[n:], n)
+                self._snapshot = _Snapshot(current.matrix, current.sq_norms, current.ids, current.meta, current.partitions, ivf,
+                                           current.categories)
+        finally:
+            self._training = False
+
+    def publish(self, store):
+        """
+        Publish the current snapshot to a SharedStateStore for worker processes.
+        The publishing process keeps its growable buffers, so later refreshes
+        still only append the new rows.
+        """
+        self.generation = store.publish_index(self._snapshot.save)
+        return self.generation
+
+    def attach(self):
+        """
+        Switch to the latest snapshot published to the shared store, if it is new.
+        """
+        generation = self.shared_store.index_generation()
+        if generation is None or generation == self.generation:
+            return False
+        snap = _Snapshot.load(self.shared_store.index_dir(generation))
+        with self._lock:
+            self._snapshot = snap
+            self.generation = generation
+            self.last_refresh = time.monotonic()
+        return True
+
+    def ensure_fresh(self, db):
+        """
+        Refresh the index if it has never been loaded or is older than refresh_seconds.
+        """
+        if self.shared_store is not None:
+            self.attach()
+            return
+        if self.last_refresh is None or time.monotonic() - self.last_refresh >= self.refresh_seconds:
+            self.refresh(db)
+
+    def _filtered_rows(self, snap, filters):
+        """
+        Row positions matching `filters`. Partitions narrow the rows down by
+        chromosome and length bucket, then the remaining predicates are applied
+        as vectorized masks over those rows only.
+        """
+        min_len, max_len = filters.get("min_seq_len"), filters.get("max_seq_len")
+        keys = snap.partitions.keys()
+        if filters.get("chr") is not None:
+            chr_code = snap.code("chr", filters["chr"])
+            keys = [key for key in keys if key[0] == chr_code]
+        if min_len is not None or max_len is not None:
+            lo = min_len // self.length_bucket if min_len is not None else -1
+            hi = max_len // self.length_bucket if max_len is not None else float("inf")
+            keys = [key for key in keys if key[1] >= 0 and lo <= key[1] <= hi]
+        parts = [snap.partitions[key] for key in keys]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        rows = np.sort(np.concatenate(parts))
+        
+        mask = np.ones(len(rows), dtype=bool)
+        if min_len is not None:
+            mask &= snap.meta["seq_len"][rows] >= min_len
+        if max_len is not None:
+            mask &= snap.meta["seq_len"][rows] <= max_len
+        if filters.get("strand") is not None:
+            strand_code = snap.code("strand", filters["strand"])
+            if strand_code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= snap.meta["strand"][rows] == strand_code
+        if filters.get("min_paired_ratio") is not None:
+            mask &= snap.meta["paired_ratio"][rows] >= filters["min_paired_ratio"]
+        if filters.get("max_paired_ratio") is not None:
+            mask &= snap.meta["paired_ratio"][rows] <= filters["max_paired_ratio"]
+        return rows[mask]
+
+    def search(self, query_vector, k=30, metric="squared", nprobe=None, filters=None, with_vectors=False):
+        """
+        Return (ids, distances) of the k nearest rows, closest first.
+        With with_vectors=True, also return their stored embeddings as a (k, D)
+        float32 array, read from the same snapshot that was scored.
+        
+        `filters` may contain chr, strand, min_seq_len, max_seq_len,
+        min_paired_ratio and max_paired_ratio; None values are ignored.
+        Filtered queries are always exact over the matching rows.
+        """
+        snap = self._snapshot
+        query = torch.as_tensor(np.asarray(query_vector, dtype=np.float32)).reshape(1, -1)
+        if len(snap.ids) == 0 or query.shape[1] != snap.matrix.shape[1]:
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            return empty + (np.empty((0, query.shape[1]), dtype=np.float32),) if with_vectors else empty
+        
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        if filters:
+            rows = self._filtered_rows(snap, filters)
+        elif snap.ivf is not None:
+            rows = snap.ivf.candidates(query, nprobe or self.nprobe, metric)
+        else:
+            rows = None
+        
+        ROWS_SCANNED.inc(len(snap.ids) if rows is None else len(rows), kind="search")
+        if rows is None:
+            distances = pairwise_distances(query, snap.matrix, metric, snap.sq_norms)[0]
+        else:
+            rows_t = torch.from_numpy(rows)
+            distances = pairwise_distances(query, snap.matrix[rows_t], metric, snap.sq_norms[rows_t])[0]
+        k = min(k, distances.shape[0])
+        values, positions = torch.topk(distances, k, largest=False)
+        positions = positions.numpy()
+        if rows is not None:
+            positions = rows[positions]
+        if with_vectors:
+            return snap.ids[positions], values.numpy(), snap.matrix[torch.from_numpy(positions)].numpy()
+        return snap.ids[positions], values.numpy()
+
+    def search_many(self, query_vectors, k=30, metric="squared", filters=None, query_block=1024, tile_size=65536):
+        """
+        Exact top-k for many queries at once. Returns (ids, distances), both of
+        shape (Q, k'), closest first, where k' = min(k, number of candidate rows).
+        
+        The query x database distance matrix is never materialized: queries are
+        processed in blocks of `query_block` and rows in tiles of `tile_size`,
+        each tile is one GEMM, and a running top-k per query is merged with the
+        tile's own top-k. Scoring a tile materializes a few (query_block,
+        tile_size) float32 temporaries (the dot products, their scaled copy and
+        the sum), so peak memory is about 3 * query_block * tile_size * 4 bytes
+        plus the gathered (tile_size, D) rows: ~800 MB with the defaults.
+        """
+        snap = self._snapshot
+        queries = torch.as_tensor(np.asarray(query_vectors, dtype=np.float32))
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        n_queries = queries.shape[0]
+        if len(snap.ids) == 0 or queries.shape[1] != snap.matrix.shape[1]:
+            return np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=np.float32)
+        
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        rows = self._filtered_rows(snap, filters) if filters else np.arange(len(snap.ids))
+        k = min(k, len(rows))
+        ROWS_SCANNED.inc(len(rows) * n_queries, kind="batch_search")
+        out_ids = np.empty((n_queries, k), dtype=np.int64)
+        out_dist = np.empty((n_queries, k), dtype=np.float32)
+        if k == 0:
+            return out_ids, out_dist
+        
+        for q in range(0, n_queries, query_block):
+            block = queries[q:q+query_block]
+            best_values = torch.full((block.shape[0], k), float("inf"))
+            best_rows = torch.zeros((block.shape[0], k), dtype=torch.long)
+            for t in range(0, len(rows), tile_size):
+                tile_rows = torch.from_numpy(rows[t:t+tile_size])
+                distances = pairwise_distances(block, snap.matrix[tile_rows], metric, snap.sq_norms[tile_rows])
+                tile_k = min(k, distances.shape[1])
+                values, positions = torch.topk(distances, tile_k, dim=1, largest=False)
+                # Merge the tile's candidates into the running top-k
+                merged_values = torch.cat([best_values, values], dim=1)
+                merged_rows = torch.cat([best_rows, tile_rows[positions]], dim=1)
+                best_values, keep = torch.topk(merged_values, k, dim=1, largest=False)
+                best_rows = torch.gather(merged_rows, 1, keep)
+            out_ids[q:q+query_block] = snap.ids[best_rows.numpy()]
+            out_dist[q:q+query_block] = best_values.numpy()
+        return out_ids, out_dist
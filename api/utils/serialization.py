@@ -0,0 +1,125 @@
+import importlib
+import io
+from typing import Optional
+
+import numpy as np
+from fastapi import Header, HTTPException, Query, Response
+
+from api.utils.metrics import stage
+
+# Response formats and their media types. JSON (or TSV for /tsv_embed) is the default.
+MEDIA_TYPES = {
+    "npz": "application/x-npz",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "msgpack": "application/msgpack",
+}
+_ACCEPT_ALIASES = {
+    "application/x-npz": "npz",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/json": "json",
+}
+# A bare .npy holds a single array and cannot carry the ids next to the matrix
+_NPY_MESSAGE = "A single .npy cannot carry the ids; use format=npz (application/x-npz) instead."
+
+
+# Optional libraries needed by some formats
+_FORMAT_LIBRARIES = {"arrow": "pyarrow", "msgpack": "msgpack"}
+
+
+def _available(fmt):
+    """
+    Raise 406 if the library needed to encode `fmt` is not installed. Checked in
+    the dependency, so the endpoints' own error handling never turns it into a 500.
+    """
+    library = _FORMAT_LIBRARIES.get(fmt)
+    if library is None:
+        return fmt
+    try:
+        importlib.import_module(library)
+    except ImportError:
+        raise HTTPException(status_code=406, detail=f"{fmt} output requires {library} to be installed.")
+    return fmt
+
+
+def response_format(
+    format: Optional[str] = Query(None, description="Response format: json, npz, arrow or msgpack (overrides Accept)"),
+    accept: Optional[str] = Header(None),
+):
+    """
+    FastAPI dependency that picks the response format from the `format` query
+    parameter or, failing that, the first recognised media type in Accept.
+    npy is refused with 406 rather than silently answered with an .npz.
+    """
+    if format is not None:
+        if format == "npy":
+            raise HTTPException(status_code=406, detail=_NPY_MESSAGE)
+        if format != "json" and format not in MEDIA_TYPES:
+            raise HTTPException(status_code=406, detail=f"Unsupported format: {format}")
+        return _available(format)
+    media_types = [media_type.split(";")[0].strip().lower() for media_type in (accept or "").split(",")]
+    for media_type in media_types:
+        fmt = _ACCEPT_ALIASES.get(media_type)
+        if fmt is not None:
+            return _available(fmt)
+    if "application/x-npy" in media_types and "*/*" not in media_types:
+        raise HTTPException(status_code=406, detail=_NPY_MESSAGE)
+    return "json"
+
+
+def _encode_npz(ids, matrix, columns):
+    buffer = io.BytesIO()
+    np.savez(buffer, ids=np.asarray(ids), embeddings=matrix, **columns)
+    return buffer.getvalue()
+
+
+def _encode_arrow(ids, matrix, columns):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow output requires pyarrow to be installed.")
+    # pa.array over a contiguous float32 buffer does not copy it
+    values = pa.array(matrix.reshape(-1))
+    arrays = {"id": pa.array(list(ids)), "embedding": pa.FixedSizeListArray.from_arrays(values, matrix.shape[1])}
+    arrays.update({name: pa.array(column) for name, column in columns.items()})
+    batch = pa.RecordBatch.from_pydict(arrays)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_msgpack(ids, matrix, columns):
+    try:
+        import msgpack
+    except ImportError:
+        raise HTTPException(status_code=406, detail="msgpack output requires msgpack to be installed.")
+    payload = {
+        "ids": [i.item() if isinstance(i, np.generic) else i for i in ids],
+        "shape": list(matrix.shape),
+        "dtype": "<f4",
+        # Raw little-endian float32 bytes, read back with np.frombuffer(...).reshape(shape)
+        "embeddings": memoryview(matrix),
+    }
+    payload.update({name: np.asarray(column).tolist() for name, column in columns.items()})
+    return msgpack.packb(payload)
+
+
+_ENCODERS = {"npz": _encode_npz, "arrow": _encode_arrow, "msgpack": _encode_msgpack}
+
+
+def matrix_response(fmt, ids, vectors, dim=0, **columns):
+    """
+    Binary response carrying `ids` plus the embeddings as one contiguous
+    little-endian float32 matrix (rows in the same order as ids). Extra 1D
+    `columns` (e.g. distances, window starts) are sent alongside.
+    """
+    with stage("serialize"):
+        if len(vectors):
+            matrix = np.ascontiguousarray(np.stack(vectors), dtype="<f4")
+        else:
+            matrix = np.empty((0, dim), dtype="<f4")
+        body = _ENCODERS[fmt](ids, matrix, {name: np.asarray(column) for name, column in columns.items()})
+    return Response(content=body, media_type=MEDIA_TYPES[fmt])
@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import time
+
+import torch
+
+
+class SharedStateStore:
+    """
+    Model weights and search index snapshots shared by the workers of a
+    multi-worker server (see api/server.py) through memory-mapped files.
+
+    The parent process exports the model once and publishes every index refresh
+    as a new numbered generation directory. Workers map these files instead of
+    loading their own copies, so the pages are shared through the page cache.
+    The current generation is recorded in a small manifest that is replaced with
+    os.replace, so a worker always moves from one complete snapshot to the next.
+    Only the parent writes to the store.
+    """
+
+    MODEL_FILE = "model.pt"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, directory, poll_seconds=1.0):
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._checked_at = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def manifest(self, max_age=0.0):
+        """
+        Current manifest, re-read from disk when older than `max_age` seconds and changed.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < max_age:
+            return self._manifest
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._path(self.MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            with open(self._path(self.MANIFEST_FILE)) as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def _update_manifest(self, **values):
+        manifest = {**self.manifest(), **values}
+        tmp = self._path(f"{self.MANIFEST_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(self.MANIFEST_FILE))
+        self._checked_at = None
+
+    def export_model(self, model, checkpoint_hash):
+        """
+        Save the whole (CPU) model module so workers can map its weights.
+        """
+        tmp = self._path(f"{self.MODEL_FILE}.tmp")
+        torch.save(model, tmp)
+        os.replace(tmp, self._path(self.MODEL_FILE))
+        self._update_manifest(checkpoint_hash=checkpoint_hash)
+
+    def load_model(self, device="cpu"):
+        """
+        Map the exported model; returns (model, checkpoint_hash). On CPU the
+        parameters stay backed by the shared file.
+        """
+        model = torch.load(self._path(self.MODEL_FILE), map_location="cpu", mmap=True, weights_only=False)
+        model.to(device)
+        model.eval()
+        return model, self.manifest()["checkpoint_hash"]
+
+    def index_generation(self):
+        """
+        Latest published index generation, or None. The manifest is checked at
+        most every poll_seconds.
+        """
+        return self.manifest(max_age=self.poll_seconds).get("index_generation")
+
+    def index_dir(self, generation):
+        return self._path(f"index-{generation}")
+
+    def publish_index(self, write_fn):
+        """
+        Publish a new index generation: `write_fn(directory)` writes the snapshot
+        files, the directory is renamed into place and the manifest switched to it.
+        Returns the new generation.
+        """
+        current = self.manifest().get("index_generation") or 0
+        generation = current + 1
+        tmp_dir = f"{self.index_dir(generation)}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        write_fn(tmp_dir)
+        os.replace(tmp_dir, self.index_dir(generation))
+        self._update_manifest(index_generation=generation)
+        # Keep the previous generation for workers that are still loading it; older
+        # ones can go, since workers that mapped them keep the pages after unlink
+        keep = {os.path.basename(self.index_dir(g)) for g in (current, generation)}
+        for name in os.listdir(self.directory):
+            if name.startswith("index-") and not name.endswith(".tmp") and name not in keep:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+        return generation
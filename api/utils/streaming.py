@@ -0,0 +1,77 @@
+import csv
+import io
+
+from starlette.concurrency import run_in_threadpool
+
+
+class UndecodableLine(str):
+    """
+    A line that is not valid UTF-8, decoded with replacement characters.
+    `error` describes why it could not be decoded.
+    """
+
+    def __new__(cls, raw, error):
+        line = super().__new__(cls, raw.decode("utf-8", errors="replace"))
+        line.error = error
+        return line
+
+
+def _decode_line(raw):
+    raw = raw.rstrip(b"\r")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return UndecodableLine(raw, f"Invalid UTF-8 at byte {e.start}")
+
+
+async def read_upload_lines(upload, chunk_size=1 << 20):
+    """
+    Yield decoded lines from an UploadFile, reading it `chunk_size` bytes at a time
+    so the whole file is never held in memory. A line that is not valid UTF-8 is
+    yielded as an UndecodableLine rather than failing the rest of the file.
+    """
+    buffer = b""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield _decode_line(line)
+    if buffer.strip():
+        yield _decode_line(buffer)
+
+
+def format_tsv_rows(rows):
+    """
+    Serialize a list of rows (lists of strings) as TSV text.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+async def stream_tsv_chunks(lines, process_rows, rows_per_chunk=1024):
+    """
+    Group parsed TSV rows from `lines` into chunks of `rows_per_chunk` and yield
+    the TSV text returned by `process_rows(rows, errors)` for each one, where
+    `errors` holds the decoding error of each row ("" for rows read cleanly).
+
+    `process_rows` is blocking (it runs inference), so it is executed in the
+    threadpool. The generator only pulls the next chunk from the upload once the
+    previous output has been consumed, which gives natural backpressure when it
+    feeds a StreamingResponse.
+    """
+    pending, errors = [], []
+    async for line in lines:
+        if not line.strip():
+            continue
+        pending.append(next(csv.reader([line], delimiter="\t")))
+        errors.append(getattr(line, "error", ""))
+        if len(pending) >= rows_per_chunk:
+            yield await run_in_threadpool(process_rows, pending, errors)
+            pending, errors = [], []
+    if pending:
+        yield await run_in_threadpool(process_rows, pending, errors)
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+
+from api.utils.postprocess import pack_embedding
+from benchmarks.synthetic import paired_ratio, random_sequence, structure_set
+from db.models import Base, Embedding
+
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY"]
+
+
+def build_sqlite_fixture(path, rows, dim, lengths=(50, 200, 1000), pairing_density=0.5, seed=0,
+                         storage_dtype="float32", chunk_size=5000):
+    """
+    Create a SQLite database at `path` with the app's tables and `rows`
+    exon_embeddings rows: synthetic structures and sequences, random metadata
+    and random unit-norm packed embeddings of `dim` dimensions.
+    Returns the database URL.
+    """
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, future=True)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rng = random.Random(seed)
+    vectors_rng = np.random.default_rng(seed)
+    # A few hundred distinct structures are enough; rows reuse them
+    structures = structure_set(min(rows, 500), lengths, pairing_density, seed)
+    with engine.begin() as conn:
+        for offset in range(0, rows, chunk_size):
+            count = min(chunk_size, rows - offset)
+            vectors = vectors_rng.standard_normal((count, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            records = []
+            for i in range(count):
+                structure = structures[(offset + i) % len(structures)]
+                start = rng.randrange(1, 100_000_000)
+                records.append({
+                    "gene_id": f"BENCH{offset + i:09d}",
+                    "gene_name": f"bench_{offset + i}",
+                    "chr": rng.choice(CHROMOSOMES),
+                    "start": start,
+                    "end": start + len(structure) - 1,
+                    "strand": rng.choice("+-"),
+                    "rna_sequence": random_sequence(len(structure), rng),
+                    "rna_ss": structure,
+                    "seq_len": len(structure),
+                    "paired_ratio": paired_ratio(structure),
+                    "embedding_packed": pack_embedding(vectors[i], storage_dtype),
+                    "embedding_dtype": storage_dtype,
+                })
+            conn.execute(insert(Embedding), records)
+    engine.dispose()
+    return url
@@ -0,0 +1,275 @@
+"""
+Benchmark suite for the embedding, comparison and search paths.
+
+    python -m benchmarks.run --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --quick --baseline benchmarks/results/<previous>.json
+
+Builds a temporary SQLite fixture with --rows synthetic embeddings, then measures
+throughput and p50/p95/p99 latency of get_gin_embedding (single, batched,
+windowed), calculate_query_distances and every FastAPI endpoint under
+concurrent load through an in-process ASGI client. Results are written as JSON;
+with --baseline the change against a previous run is printed as well.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import structure_set
+
+
+def summarize(name, latencies, wall_seconds, items_per_call=1, **extra):
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "items": len(latencies) * items_per_call,
+        "wall_seconds": wall_seconds,
+        "calls_per_second": len(latencies) / wall_seconds if wall_seconds else 0.0,
+        "items_per_second": len(latencies) * items_per_call / wall_seconds if wall_seconds else 0.0,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        **extra,
+    }
+
+
+def measure(name, fn, calls, items_per_call=1, warmup=2, **extra):
+    """
+    Time `calls` sequential calls of fn(i).
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(calls):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, latencies, time.perf_counter() - start, items_per_call, **extra)
+
+
+async def measure_load(name, send, requests, concurrency, items_per_call=1, warmup=2, **extra):
+    """
+    Issue `requests` calls of `await send(i)` with at most `concurrency` in flight.
+    """
+    for i in range(warmup):
+        (await send(i)).raise_for_status()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            t = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - t)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(name, latencies, time.perf_counter() - start, items_per_call, concurrency=concurrency, **extra)
+
+
+def bench_functions(args, model, graph_encoding, device, results):
+    from api.utils.embedding import calculate_query_distances, get_gin_embedding
+
+    for length in args.lengths:
+        pool = structure_set(args.calls + 2, (length,), args.density, seed=args.seed + length)
+        results.append(measure(
+            f"get_gin_embedding.single[len={length}]",
+            lambda i: get_gin_embedding(model, graph_encoding, [pool[i % len(pool)]], device),
+            args.calls, length=length))
+
+        batch = args.batch_size
+        pool = structure_set(batch * 4, (length,), args.density, seed=args.seed + 2 * length)
+        results.append(measure(
+            f"get_gin_embedding.batched[len={length},batch={batch}]",
+            lambda i: get_gin_embedding(model, graph_encoding, [pool[(i * batch + j) % len(pool)] for j in range(batch)],
+                                        device, batch_size=batch),
+            max(1, args.calls // 4), items_per_call=batch, length=length, batch_size=batch))
+
+    # Heterogeneous lengths with some repeats, in arrival order vs planned by node count
+    batch = args.batch_size * 4
+    mixed = structure_set(batch, args.lengths, args.density, seed=args.seed + 11)
+    mixed = mixed + mixed[:batch // 8]
+    results.append(measure(
+        f"get_gin_embedding.mixed_arrival[n={len(mixed)}]",
+        lambda i: get_gin_embedding(model, graph_encoding, mixed, device, batch_size=args.batch_size),
+        max(1, args.calls // 10), items_per_call=len(mixed)))
+    results.append(measure(
+        f"get_gin_embedding.mixed_planned[n={len(mixed)},nodes={args.max_batch_nodes}]",
+        lambda i: get_gin_embedding(model, graph_encoding, mixed, device, max_batch_nodes=args.max_batch_nodes),
+        max(1, args.calls // 10), items_per_call=len(mixed)))
+
+    length = max(args.lengths)
+    pool = structure_set(args.calls + 2, (length,), args.density, seed=args.seed + 3 * length)
+    results.append(measure(
+        f"get_gin_embedding.windowed[len={length},L={args.window}]",
+        lambda i: get_gin_embedding(model, graph_encoding, [pool[i % len(pool)]], device, L=args.window),
+        max(1, args.calls // 4), length=length, window=args.window))
+
+    dim = len(get_gin_embedding(model, graph_encoding, [pool[0]], device)[0][0][1])
+    candidates = np.random.default_rng(args.seed).standard_normal((args.rows, dim)).astype(np.float32)
+    query = candidates[0]
+    for metric in ("squared", "cosine"):
+        results.append(measure(
+            f"calculate_query_distances[{metric},n={args.rows}]",
+            lambda i: calculate_query_distances(query, candidates, metric),
+            args.calls, items_per_call=args.rows, metric=metric))
+    return dim
+
+
+async def bench_endpoints(args, results):
+    # Settings are read at import, so the environment must be in place first
+    import httpx
+    from api.main import app
+
+    structures = structure_set(max(args.requests * 4, 256), args.lengths, args.density, seed=args.seed + 7)
+
+    def pick(i, n=1):
+        return [structures[(i * n + j) % len(structures)] for j in range(n)]
+
+    def tsv(i, n):
+        rows = "".join(f"s{j}\t{s}\n" for j, s in enumerate(pick(i, n)))
+        return {"file": ("bench.tsv", "id\tsecondary_structure\n" + rows, "text/tab-separated-values")}
+
+    endpoints = [
+        ("/embed", 1, lambda c, i: c.post("/embed", json={"structure": pick(i)[0]})),
+        ("/embed?format=npz", 1, lambda c, i: c.post("/embed", params={"format": "npz"}, json={"structure": pick(i)[0]})),
+        ("/compare[1x16]", 16, lambda c, i: c.post("/compare", json={"structure1": pick(i)[0], "structure2": pick(i + 1, 16)})),
+        ("/pairwise[16]", 16, lambda c, i: c.post("/pairwise", json={"structures": pick(i, 16)})),
+        ("/search[k=10]", 1, lambda c, i: c.post("/search", json={"structure": pick(i)[0], "k": 10})),
+        ("/search[k=10,chr=chr1]", 1, lambda c, i: c.post("/search", json={"structure": pick(i)[0], "k": 10, "chr": "chr1"})),
+        ("/batch_search[16,k=10]", 16, lambda c, i: c.post("/batch_search", json={
+            "items": [{"id": str(j), "structure": s} for j, s in enumerate(pick(i, 16))], "k": 10})),
+        ("/batch_embed[32]", 32, lambda c, i: c.post("/batch_embed", json={
+            "items": [{"id": str(j), "structure": s} for j, s in enumerate(pick(i, 32))]})),
+        ("/tsv_embed[64]", 64, lambda c, i: c.post("/tsv_embed", files=tsv(i, 64))),
+        ("/tsv_embed?stream[64]", 64, lambda c, i: c.post("/tsv_embed", params={"stream": "true"}, files=tsv(i, 64))),
+    ]
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name, items, send in endpoints:
+                if args.endpoints and not any(name.startswith(e) for e in args.endpoints):
+                    continue
+                results.append(await measure_load(f"endpoint {name}", lambda i, send=send: send(client, i),
+                                                  args.requests, args.concurrency, items_per_call=items))
+
+
+def compare_with_baseline(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nChange against {baseline_path} (p50 latency, throughput):")
+    for r in results:
+        old = baseline.get(r["name"])
+        if old is None:
+            continue
+        p50 = (r["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0.0
+        tput = (r["items_per_second"] / old["items_per_second"] - 1) * 100 if old["items_per_second"] else 0.0
+        print(f"  {r['name']:<55} p50 {p50:+7.1f}%  throughput {tput:+7.1f}%")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding, comparison and search paths.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", "models/model_weights.pth"))
+    parser.add_argument("--rows", type=int, default=20000, help="Embeddings in the SQLite fixture")
+    parser.add_argument("--lengths", type=lambda v: [int(x) for x in v.split(",")], default=[50, 200, 1000])
+    parser.add_argument("--density", type=float, default=0.6, help="Fraction of paired positions in synthetic structures")
+    parser.add_argument("--calls", type=int, default=50, help="Calls per function benchmark")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-batch-nodes", type=int, default=32768, help="Node cap for the planned batching benchmark")
+    parser.add_argument("--window", type=int, default=100, help="Window length L for the windowed benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--endpoints", nargs="*", help="Only run endpoints whose name starts with one of these")
+    parser.add_argument("--skip-functions", action="store_true")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--keep-cache", action="store_true", help="Leave the embedding cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="Small run for a smoke check")
+    args = parser.parse_args()
+    if args.quick:
+        args.rows, args.calls, args.requests = min(args.rows, 2000), min(args.calls, 10), min(args.requests, 40)
+
+    import torch
+    from api.models import load_model
+    from benchmarks.fixture import build_sqlite_fixture
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = load_model(args.model_path, device)
+    graph_encoding = model.metadata.get("graph_encoding", "standard")
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="ginfinity-bench-")
+    dim = None
+    try:
+        if not args.skip_functions:
+            dim = bench_functions(args, model, graph_encoding, device, results)
+
+        if not args.skip_endpoints:
+            if dim is None:
+                from api.utils.embedding import get_gin_embedding
+                dim = len(get_gin_embedding(model, graph_encoding, ["((((....))))"], device)[0][0][1])
+            del model
+            database_url = build_sqlite_fixture(os.path.join(workdir, "bench.db"), args.rows, dim, args.lengths, args.density, args.seed)
+            os.environ.update({
+                "DATABASE_URL": database_url,
+                "MODEL_PATH": args.model_path,
+                "JOB_DATA_DIR": os.path.join(workdir, "jobs"),
+                # The index is loaded once; refreshes would only add noise
+                "SEARCH_INDEX_REFRESH_SECONDS": "3600",
+            })
+            if not args.keep_cache:
+                os.environ.update({"EMBEDDING_CACHE_SIZE": "0", "EMBEDDING_CACHE_PATH": ""})
+            asyncio.run(bench_endpoints(args, results))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "device": device,
+            "torch_threads": torch.get_num_threads(),
+            "embedding_dim": dim,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        print(f"{r['name']:<55} {r['items_per_second']:>10.1f} items/s  "
+              f"p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms")
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import random
+
+NUCLEOTIDES = "ACGU"
+
+
+def _dyck_word(stems, rng):
+    """
+    Random nesting of `stems` stems: a balanced sequence of +1 (open) and -1 (close).
+    """
+    word, opened, depth = [], 0, 0
+    while len(word) < 2 * stems:
+        remaining = stems - opened
+        if remaining and (depth == 0 or rng.random() < remaining / (remaining + depth)):
+            word.append(1)
+            opened += 1
+            depth += 1
+        else:
+            word.append(-1)
+            depth -= 1
+    return word
+
+
+def random_structure(length, pairing_density=0.5, rng=None, mean_stem=4, min_loop=3):
+    """
+    Random valid dot-bracket structure of `length` nucleotides in which about
+    `pairing_density` of the positions are paired (capped so that every hairpin
+    loop has at least `min_loop` unpaired bases). Stems average `mean_stem` pairs.
+    """
+    rng = rng or random.Random()
+    pairs = int(round(pairing_density * length / 2))
+    while pairs > 0:
+        stems = max(1, round(pairs / mean_stem))
+        if 2 * pairs + stems * min_loop <= length:
+            break
+        pairs -= 1
+    if pairs <= 0:
+        return "." * length
+
+    # Split the pairs into stems of at least one pair each
+    sizes = [1] * stems
+    for _ in range(pairs - stems):
+        sizes[rng.randrange(stems)] += 1
+
+    word = _dyck_word(stems, rng)
+    # Gaps between consecutive stem tokens (plus both ends); hairpin gaps get min_loop dots
+    gaps = [0] * (len(word) + 1)
+    for i in range(len(word) - 1):
+        if word[i] == 1 and word[i + 1] == -1:
+            gaps[i + 1] = min_loop
+    for _ in range(length - 2 * pairs - sum(gaps)):
+        gaps[rng.randrange(len(gaps))] += 1
+
+    parts, open_sizes, next_size = ["." * gaps[0]], [], 0
+    for i, token in enumerate(word):
+        if token == 1:
+            size = sizes[next_size]
+            next_size += 1
+            open_sizes.append(size)
+            parts.append("(" * size)
+        else:
+            parts.append(")" * open_sizes.pop())
+        parts.append("." * gaps[i + 1])
+    return "".join(parts)
+
+
+def random_sequence(length, rng=None):
+    rng = rng or random.Random()
+    return "".join(rng.choice(NUCLEOTIDES) for _ in range(length))
+
+
+def paired_ratio(structure):
+    return sum(1 for c in structure if c != ".") / len(structure) if structure else 0.0
+
+
+def structure_set(count, lengths=(50, 200, 1000), pairing_density=0.5, seed=0):
+    """
+    `count` distinct structures, cycling through `lengths`. Structures are
+    made unique so content caches do not flatter the numbers.
+    """
+    rng = random.Random(seed)
+    seen, structures = set(), []
+    attempts = 0
+    while len(structures) < count:
+        length = lengths[len(structures) % len(lengths)]
+        structure = random_structure(length, pairing_density, rng)
+        attempts += 1
+        if structure in seen and attempts < count * 100:
+            continue
+        seen.add(structure)
+        structures.append(structure)
+    return structures
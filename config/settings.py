@@ -14,5 +14,67 @@ DATABASE_USER = os.getenv("DATABASE_USER",  default=None)
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD", default=None)
 DATABASE_NAME = os.getenv("DATABASE_NAME", "rna_db")
 
-# Construct the connection URL for MySQL (using pymysql)
-DATABASE_URL = f"mysql+pymysql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
+# Construct the connection URL for MySQL (using pymysql).
+# DATABASE_URL overrides it, e.g. "sqlite:///./rna_local.db" for a local stand-in.
+DATABASE_URL = os.getenv("DATABASE_URL") or f"mysql+pymysql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
+# Log every SQL statement (off by default, it is very verbose)
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")
+# Connection pool of the database server (ignored for SQLite)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 10))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 20))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", 3600))  # seconds, below MySQL's wait_timeout
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", 30))
+# Also open an async engine (aiomysql, or aiosqlite for SQLite URLs) for request-time queries
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() in ("1", "true", "yes")
+# Rows per chunk when streaming vectors from the database into the search index
+DATABASE_STREAM_CHUNK_SIZE = int(os.getenv("DATABASE_STREAM_CHUNK_SIZE", 10000))
+
+# Micro-batching of the single-structure endpoints (/embed, /compare, /search)
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", 32))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", 5))
+
+# Embedding cache: in-memory LRU size and optional SQLite file for a persistent tier
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", None)  # None means memory only
+
+# In-memory search index for /search ("exact" or "ivf" for approximate search)
+SEARCH_INDEX_MODE = os.getenv("SEARCH_INDEX_MODE", "exact")
+SEARCH_IVF_NLIST = int(os.getenv("SEARCH_IVF_NLIST", 0))  # 0 means sqrt(number of rows)
+SEARCH_IVF_NPROBE = int(os.getenv("SEARCH_IVF_NPROBE", 8))
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", 30))
+# Width in nucleotides of the sequence length partitions used by filtered search
+SEARCH_LENGTH_BUCKET = int(os.getenv("SEARCH_LENGTH_BUCKET", 100))
+# /batch_search scores queries in blocks against tiles of index rows; peak memory is
+# about 3 x block x tile x 4 bytes (256 MB per block x tile matrix with the defaults)
+SEARCH_QUERY_BLOCK = int(os.getenv("SEARCH_QUERY_BLOCK", 1024))
+SEARCH_TILE_SIZE = int(os.getenv("SEARCH_TILE_SIZE", 65536))
+
+# Storage dtype for packed embeddings written to the database ("float32" or "float16")
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+# Graph construction process pool (0 disables it and builds graphs inline)
+GRAPH_WORKERS = int(os.getenv("GRAPH_WORKERS", 0))
+GRAPH_PREFETCH_BATCHES = int(os.getenv("GRAPH_PREFETCH_BATCHES", 2))
+# Torch intra-op threads, set once at startup (0 keeps torch's default)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", 0))
+# Cap on the total nodes (nucleotides) of the structures in one forward pass; structures
+# are deduplicated and grouped by length first (0 disables this and batches by count)
+EMBED_MAX_BATCH_NODES = int(os.getenv("EMBED_MAX_BATCH_NODES", 32768))
+
+# Background embedding jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", 1000))
+JOB_DATA_DIR = os.getenv("JOB_DATA_DIR", "jobs")
+
+# Inference backend: "eager", "compile" (torch.compile) or "quantized" (dynamic int8, CPU only)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+# Structure lengths used to warm up the model at startup
+INFERENCE_WARMUP_LENGTHS = [int(x) for x in os.getenv("INFERENCE_WARMUP_LENGTHS", "64,256,1024").split(",") if x.strip()]
+# Max relative L2 error against eager embeddings before falling back to eager
+INFERENCE_ACCURACY_TOLERANCE = float(os.getenv("INFERENCE_ACCURACY_TOLERANCE", 0.05))
+
+# Multi-worker serving (python -m api.server): the parent loads the model and search
+# index once and shares them with API_WORKERS uvicorn workers through SHARED_STATE_DIR
+API_WORKERS = int(os.getenv("API_WORKERS", 1))
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", None)  # set by api.server for its workers
+SHARED_STATE_POLL_SECONDS = float(os.getenv("SHARED_STATE_POLL_SECONDS", 1))
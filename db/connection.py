@@ -1,13 +1,44 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from config.settings import DATABASE_URL
+from config.settings import DATABASE_URL, DATABASE_ECHO, DATABASE_ASYNC
+from config.settings import DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_RECYCLE, DATABASE_POOL_TIMEOUT
 
-# Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+# Async drivers used in place of the sync ones when DATABASE_ASYNC is enabled
+ASYNC_DRIVERS = {
+    "mysql+pymysql://": "mysql+aiomysql://",
+    "mysql://": "mysql+aiomysql://",
+    "sqlite://": "sqlite+aiosqlite://",
+}
+
+def async_url(url):
+    for sync_prefix, async_prefix in ASYNC_DRIVERS.items():
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    raise ValueError(f"No async driver known for {url.split('://')[0]}")
+
+def _pool_options(url):
+    # SQLite's default pool is not sized; pooled servers get the configured limits
+    if url.startswith("sqlite"):
+        return {}
+    return {"pool_size": DATABASE_POOL_SIZE, "max_overflow": DATABASE_MAX_OVERFLOW,
+            "pool_recycle": DATABASE_POOL_RECYCLE, "pool_timeout": DATABASE_POOL_TIMEOUT, "pool_pre_ping": True}
+
+# Create the SQLAlchemy engine (SQLite connections are shared with worker threads)
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, echo=DATABASE_ECHO, future=True, connect_args=connect_args, **_pool_options(DATABASE_URL))
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Optional async engine (aiomysql / aiosqlite), so endpoints can await the database
+# instead of holding a threadpool thread while it answers
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    async_engine = create_async_engine(async_url(DATABASE_URL), echo=DATABASE_ECHO, **_pool_options(DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 # Dependency to get a DB session in FastAPI
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,105 @@
+# migrate_embeddings.py
+# Adds the packed embedding columns and metadata indexes to exon_embeddings and
+# backfills the packed vectors from the comma-separated text column. Safe to re-run: only rows without a packed
+# vector are processed, so an interrupted backfill resumes where it stopped.
+#
+#   python -m db.migrate_embeddings [--dtype float16] [--chunk-size 5000] [--drop-text]
+import argparse
+
+from sqlalchemy import LargeBinary, String, bindparam, inspect, select, text, update
+
+from api.utils.postprocess import PACKED_DTYPES, pack_embedding, parse_embedding
+from config.settings import EMBEDDING_STORAGE_DTYPE
+from db.connection import engine
+from db.models import Embedding
+
+table = Embedding.__table__
+
+
+def add_packed_columns():
+    """
+    Add embedding_packed / embedding_dtype if the table predates them.
+    """
+    existing = {col["name"] for col in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        if "embedding_packed" not in existing:
+            blob_type = LargeBinary().compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN embedding_packed {blob_type}"))
+        if "embedding_dtype" not in existing:
+            dtype_type = String(8).compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN embedding_dtype {dtype_type}"))
+
+
+def create_indexes():
+    """
+    Create the metadata indexes declared on Embedding that the table is missing.
+    """
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+
+
+def backfill(dtype="float32", chunk_size=5000, drop_text=False):
+    """
+    Pack the text embeddings chunk by chunk, one transaction per chunk.
+    Returns the number of rows packed.
+    """
+    stmt = (update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values(embedding_packed=bindparam("packed"), embedding_dtype=bindparam("dtype")))
+    if drop_text:
+        stmt = stmt.values(embedding_vector=None)
+    
+    last_id, total = -1, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.embedding_vector)
+                .where(table.c.id > last_id, table.c.embedding_packed.is_(None), table.c.embedding_vector.is_not(None))
+                .order_by(table.c.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                return total
+            params = [{"row_id": row.id, "packed": pack_embedding(parse_embedding(row.embedding_vector), dtype), "dtype": dtype}
+                      for row in rows]
+            conn.execute(stmt, params)
+        last_id = rows[-1].id
+        total += len(rows)
+        print(f"Packed {total} rows (last id {last_id})")
+
+
+def relax_text_column():
+    """
+    Make embedding_vector nullable so packed-only rows can drop their text copy.
+    SQLite cannot alter column constraints in place, so it is left untouched there;
+    ingest jobs keep writing the text column on tables where it is still NOT NULL.
+    """
+    if engine.dialect.name == "mysql":
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} MODIFY embedding_vector VARCHAR(2048) NULL"))
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill packed embeddings in exon_embeddings.")
+    parser.add_argument("--dtype", choices=sorted(PACKED_DTYPES), default=EMBEDDING_STORAGE_DTYPE)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--drop-text", action="store_true",
+                        help="Clear the text column after packing (MySQL only)")
+    args = parser.parse_args()
+    
+    add_packed_columns()
+    create_indexes()
+    # Rows ingested in packed form leave the text column empty, so it must accept NULL
+    relaxed = relax_text_column()
+    drop_text = args.drop_text
+    if drop_text and not relaxed:
+        print(f"--drop-text is not supported on {engine.dialect.name}; keeping the text column.")
+        drop_text = False
+    total = backfill(args.dtype, args.chunk_size, drop_text)
+    print(f"Backfill complete: {total} rows packed as {args.dtype}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Float, LargeBinary, Text, DateTime, Index, func
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 class Embedding(Base):
     __tablename__ = "exon_embeddings"  # Updated to match your actual table name
+    # Metadata filters of /search: chromosome + length range, and strand
+    __table_args__ = (
+        Index("ix_exon_embeddings_chr_seq_len", "chr", "seq_len"),
+        Index("ix_exon_embeddings_strand", "strand"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     gene_id = Column(String(50), unique=True, index=True, nullable=False)
     gene_name = Column(String(255))
@@ -20,4 +25,29 @@ class Embedding(Base):
     seq_len = Column(Integer)
     paired_ratio = Column(Float)
     window_start = Column(String(50))
-    embedding_vector = Column(String(2048), nullable=False)
+    # Legacy comma-separated text; rows written or backfilled in packed form may leave it empty
+    embedding_vector = Column(String(2048))
+    # Packed little-endian float32/float16 vector, see db/migrate_embeddings.py
+    embedding_packed = Column(LargeBinary)
+    embedding_dtype = Column(String(8), default="float32")
+
+
+class EmbeddingJob(Base):
+    """
+    Background embedding job and its checkpoint. `processed`, `last_id` and
+    `output_offset` are updated in the same transaction as each chunk of
+    results, so a restarted job resumes after the last committed chunk.
+    """
+    __tablename__ = "embedding_jobs"
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(16), nullable=False)  # "file" or "db"
+    status = Column(String(16), nullable=False, index=True)  # queued, running, completed, failed
+    params = Column(Text)  # JSON encoded job options
+    total = Column(Integer)
+    processed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    last_id = Column(Integer, nullable=False, default=-1)
+    output_offset = Column(BigInteger, nullable=False, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,75 @@
+# repository.py
+# Data access for exon_embeddings, in two modes:
+#
+# - scoring: stream only the id, the vector columns and the few metadata columns the
+#   search index filters on, in large chunks through a server-side cursor, so loading
+#   the index never buffers the table (or its sequence strings) in memory;
+# - hydration: load the full record of a handful of ids, e.g. the final top-k hits.
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from db.models import Embedding, EmbeddingJob
+
+VECTOR_COLUMNS = (Embedding.embedding_packed, Embedding.embedding_dtype, Embedding.embedding_vector)
+FILTER_COLUMNS = (Embedding.chr, Embedding.strand, Embedding.seq_len, Embedding.paired_ratio)
+RECORD_COLUMNS = tuple(Embedding.__table__.columns)
+
+
+def scoring_chunks(db, after_id=-1, chunk_size=10000, with_filters=True):
+    """
+    Yield lists of rows (id, vector columns and, with_filters, chr/strand/seq_len/
+    paired_ratio) for every row with id > after_id, in id order, `chunk_size`
+    rows at a time. stream_results uses a server-side cursor on MySQL and plain
+    incremental fetching on SQLite.
+    """
+    columns = (Embedding.id, *VECTOR_COLUMNS, *(FILTER_COLUMNS if with_filters else ()))
+    stmt = (select(*columns)
+            # Rows still waiting for a /jobs/db run have no vector at all
+            .where(Embedding.id > after_id,
+                   Embedding.embedding_packed.is_not(None) | Embedding.embedding_vector.is_not(None))
+            .order_by(Embedding.id)
+            .execution_options(stream_results=True, yield_per=chunk_size))
+    for rows in db.execute(stmt).partitions():
+        yield rows
+
+
+def vectors_rewritten_at(db):
+    """
+    When a /jobs/db job last finished rewriting vectors of existing rows in
+    place, or None. Loads that only fetch new ids use it to know when to reload.
+    """
+    try:
+        return db.scalar(select(func.max(EmbeddingJob.updated_at))
+                         .where(EmbeddingJob.kind == "db", EmbeddingJob.status == "completed"))
+    except SQLAlchemyError:
+        # The job table does not exist yet
+        db.rollback()
+        return None
+
+
+def _records_stmt(ids):
+    return select(*RECORD_COLUMNS).where(Embedding.id.in_(ids))
+
+
+def fetch_records(db, ids, chunk_size=1000):
+    """
+    Full rows for the given ids, as {id: row}. Missing ids are left out.
+    """
+    ids = list(ids)
+    records = {}
+    for i in range(0, len(ids), chunk_size):
+        for row in db.execute(_records_stmt(ids[i:i+chunk_size])):
+            records[row.id] = row
+    return records
+
+
+async def fetch_records_async(db, ids, chunk_size=1000):
+    """
+    fetch_records for an AsyncSession.
+    """
+    ids = list(ids)
+    records = {}
+    for i in range(0, len(ids), chunk_size):
+        for row in await db.execute(_records_stmt(ids[i:i+chunk_size])):
+            records[row.id] = row
+    return records
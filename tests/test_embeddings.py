@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torch_geometric")
+pytest.importorskip("external.GINFINITY.src.utils")
+
+from torch_geometric.nn import GINConv, global_mean_pool
+
+from api.models import load_model
+from api.utils.embedding import _embed_graph_batch, _embed_windows, convert_structure_to_graph
+from config.settings import MODEL_PATH
+from external.GINFINITY.src.utils import generate_slices
+
+# Mixed lengths, so a batch holds graphs of very different sizes
+STRUCTURES = ["((((....))))", "((..((....))..))....", ".....", "(((((((....)))..))))..((((......))))..."]
+
+
+class TinyGIN(torch.nn.Module):
+    """
+    Small model with the interface of GINModel that get_gin_embedding relies on.
+    """
+
+    def __init__(self, in_dim, hidden=16, out=8):
+        super().__init__()
+        mlp = torch.nn.Sequential(torch.nn.Linear(in_dim, hidden), torch.nn.ReLU(), torch.nn.Linear(hidden, hidden))
+        self.conv = GINConv(mlp)
+        self.fc = torch.nn.Linear(hidden, out)
+
+    def get_node_embeddings(self, data):
+        return self.conv(data.x.float(), data.edge_index)
+
+    def pooling(self, x, batch):
+        return global_mean_pool(x, batch)
+
+    def forward_once(self, data):
+        batch = data.batch if data.batch is not None else torch.zeros(data.num_nodes, dtype=torch.long)
+        return self.fc(self.pooling(self.get_node_embeddings(data), batch))
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    _, tg = convert_structure_to_graph(STRUCTURES[0], "standard", "cpu")
+    return TinyGIN(tg.x.shape[1]).eval()
+
+
+def test_batched_forward_matches_per_graph(model):
+    graphs = [convert_structure_to_graph(s, "standard", "cpu")[1] for s in STRUCTURES]
+    batched = _embed_graph_batch(model, graphs, "cpu")
+    with torch.no_grad():
+        single = np.stack([model.forward_once(tg).numpy().reshape(-1) for tg in graphs])
+    assert batched.shape == single.shape
+    np.testing.assert_allclose(batched, single, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("L", [5, 8])
+def test_windows_match_per_window_pooling(model, L):
+    for structure in STRUCTURES:
+        graph, tg = convert_structure_to_graph(structure, "standard", "cpu")
+        windows = _embed_windows(model, graph, tg, "cpu", L, keep_paired_neighbors=False)
+        if graph.number_of_nodes() < L:
+            assert windows[0][0] == -1 and len(windows[0][1]) == 0
+            continue
+        # Reference: pool and project every window on its own
+        sorted_nodes = sorted(graph.nodes())
+        expected = []
+        with torch.no_grad():
+            node_embs = model.get_node_embeddings(tg)
+            for start, subgraph in generate_slices(graph, L, False):
+                indices = [sorted_nodes.index(node) for node in sorted(subgraph.nodes())]
+                if not indices:
+                    continue
+                pooled = model.pooling(node_embs[indices], torch.zeros(len(indices), dtype=torch.long))
+                expected.append((start, model.fc(pooled).numpy().reshape(-1)))
+        assert [start for start, _ in windows] == [start for start, _ in expected]
+        np.testing.assert_allclose(np.stack([vec for _, vec in windows]), np.stack([vec for _, vec in expected]),
+                                   rtol=1e-5, atol=1e-6)
+
+
+def test_batched_forward_matches_per_graph_with_trained_model():
+    # The real GINModel must pool on data.batch for batching to be exact
+    if not os.path.exists(MODEL_PATH):
+        pytest.skip(f"model weights not found at {MODEL_PATH}")
+    model = load_model(MODEL_PATH, "cpu")
+    graph_encoding = model.metadata.get("graph_encoding", "standard")
+    graphs = [convert_structure_to_graph(s, graph_encoding, "cpu")[1] for s in STRUCTURES]
+    batched = _embed_graph_batch(model, graphs, "cpu")
+    with torch.no_grad():
+        single = np.stack([model.forward_once(tg).numpy().reshape(-1) for tg in graphs])
+    assert batched.shape == single.shape
+    np.testing.assert_allclose(batched, single, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,20 @@
+from api.utils.planner import BatchPlan, split_batches
+
+
+def test_batch_plan_dedups_and_scatters_in_input_order():
+    structures = ["((..))", "..", "((((....))))", "..", "((..))", "."]
+    plan = BatchPlan(structures, max_batch_nodes=8)
+
+    assert plan.duplicates == 2
+    assert plan.structures == [".", "..", "((..))", "((((....))))"]
+    # Batches stay within the node cap; a structure above it gets a batch of its own
+    assert plan.batch_sizes == [2, 1, 1]
+    assert sum(plan.batch_sizes) == len(plan.structures)
+
+    results = [f"emb:{s}" for s in plan.structures]
+    assert plan.scatter(results) == [f"emb:{s}" for s in structures]
+
+
+def test_split_batches_with_planned_sizes():
+    assert split_batches(list("abcdef"), [2, 1, 3]) == [["a", "b"], ["c"], ["d", "e", "f"]]
+    assert split_batches(list("abcde"), 2) == [["a", "b"], ["c", "d"], ["e"]]
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("external.GINFINITY.src.utils")
+
+from api.utils.pairwise import distance_matrix_stream
+from api.utils.search_index import EmbeddingIndex, _Snapshot
+
+
+def _index_with(matrix):
+    n = matrix.shape[0]
+    meta = {"chr": np.zeros(n, dtype=np.int32), "strand": np.zeros(n, dtype=np.int32),
+            "seq_len": np.full(n, np.nan), "paired_ratio": np.full(n, np.nan)}
+    tensor = torch.from_numpy(matrix)
+    index = EmbeddingIndex()
+    index._snapshot = _Snapshot(tensor, (tensor * tensor).sum(dim=1), np.arange(100, 100 + n, dtype=np.int64), meta, {})
+    return index
+
+
+@pytest.mark.parametrize("metric", ["squared", "cosine"])
+def test_search_many_matches_brute_force_across_tiles(metric):
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((37, 6)).astype(np.float32)
+    queries = rng.standard_normal((5, 6)).astype(np.float32)
+    index = _index_with(matrix)
+
+    k = 10
+    # tile_size < k and < N, so the running top-k is merged across many tiles
+    ids, distances = index.search_many(queries, k=k, metric=metric, query_block=2, tile_size=4)
+
+    if metric == "cosine":
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        m = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        expected = 1 - q.astype(np.float64) @ m.T.astype(np.float64)
+    else:
+        expected = ((queries[:, None, :].astype(np.float64) - matrix[None, :, :]) ** 2).sum(axis=2)
+    order = np.argsort(expected, axis=1)[:, :k]
+    assert ids.shape == distances.shape == (len(queries), k)
+    np.testing.assert_array_equal(ids, order + 100)
+    np.testing.assert_allclose(distances, np.take_along_axis(expected, order, axis=1), rtol=1e-4, atol=1e-4)
+
+
+def test_search_many_k_larger_than_rows():
+    matrix = np.eye(3, dtype=np.float32)
+    ids, distances = _index_with(matrix).search_many(matrix, k=10, tile_size=2)
+    assert ids.shape == (3, 3)
+    np.testing.assert_array_equal(ids[:, 0], [100, 101, 102])
+
+
+def test_pairwise_upper_round_trips_through_squareform():
+    distance = pytest.importorskip("scipy.spatial.distance")
+    matrix = np.random.default_rng(1).standard_normal((11, 4)).astype(np.float32)
+    # block_size smaller than N, so the condensed output spans several row blocks
+    upper = np.load(io.BytesIO(b"".join(distance_matrix_stream(matrix, mode="upper", block_size=3))))
+    full = np.load(io.BytesIO(b"".join(distance_matrix_stream(matrix, mode="full", block_size=3))))
+
+    assert upper.shape == (11 * 10 // 2,)
+    np.testing.assert_allclose(distance.squareform(upper), full, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(upper, distance.pdist(matrix, "sqeuclidean"), rtol=1e-4, atol=1e-4)